@@ -0,0 +1,201 @@
+"""Benchmarks of the ND2 reader, for asv (https://asv.readthedocs.io).
+
+Run them from the repository root with::
+
+    asv run                 # benchmark the latest commit
+    asv continuous master HEAD  # compare a branch against master
+
+The benchmarks read cluster.nd2, which is included in the package. Add
+larger files by listing their paths in $PIMS_ND2_BENCH_FILES, separated by
+os.pathsep. The ND2 SDK cannot write files, so these have to be exported
+from NIS Elements, e.g. a long time series and a large multichannel stack.
+
+Timings are reported by the `time_*` benchmarks, throughput in frames/s and
+MB/s by the `track_*` benchmarks.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import shutil
+import tempfile
+import timeit
+import numpy as np
+import pims_nd2
+from pims_nd2 import ND2_Reader
+
+
+def _bench_files():
+    files = [os.path.join(os.path.dirname(pims_nd2.__file__), 'cluster.nd2')]
+    extra = os.environ.get('PIMS_ND2_BENCH_FILES', '')
+    files.extend(f for f in extra.split(os.pathsep) if f)
+    return dict((os.path.basename(f), f) for f in files)
+
+FILES = _bench_files()
+
+
+def _best_time(func, repeat=3):
+    """Returns the best wall clock time of `repeat` calls of `func`."""
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def _all_coords(reader):
+    """Returns the (t, m, z, o) coordinates of all SDK pictures, in
+    sequence index order."""
+    return [dict(zip('tmzo', (int(v) for v in coords)))
+            for coords in reader.coords_table]
+
+
+class Open(object):
+    params = [sorted(FILES), [True, False]]
+    param_names = ['file', 'memmap']
+
+    def setup(self, name, memmap):
+        self.index_dir = tempfile.mkdtemp()
+        ND2_Reader(FILES[name], index_cache=self.index_dir,
+                   memmap=memmap).close()
+
+    def teardown(self, name, memmap):
+        shutil.rmtree(self.index_dir)
+
+    def time_open(self, name, memmap):
+        ND2_Reader(FILES[name], memmap=memmap).close()
+
+    def time_open_index_cache(self, name, memmap):
+        ND2_Reader(FILES[name], index_cache=self.index_dir,
+                   memmap=memmap).close()
+
+
+class Metadata(object):
+    """The metadata properties are cached by the reader, so that each sample
+    opens a new reader."""
+    params = [sorted(FILES), [True, False]]
+    param_names = ['file', 'memmap']
+    number = 1
+    repeat = 10
+
+    def setup(self, name, memmap):
+        self.reader = ND2_Reader(FILES[name], memmap=memmap)
+
+    def teardown(self, name, memmap):
+        self.reader.close()
+
+    def time_metadata(self, name, memmap):
+        self.reader.metadata
+
+    def time_metadata_text(self, name, memmap):
+        self.reader.metadata_text
+
+    def time_frame_rate(self, name, memmap):
+        self.reader.frame_rate
+
+    def time_frame_table(self, name, memmap):
+        self.reader.frame_table
+
+
+class Get2D(object):
+    """Reads all single channel pictures with `get_frame_2D`, in sequence
+    index order or in random order."""
+    params = [sorted(FILES), [True, False], ['sequential', 'random']]
+    param_names = ['file', 'memmap', 'order']
+
+    def setup(self, name, memmap, order):
+        self.reader = ND2_Reader(FILES[name], memmap=memmap)
+        self.coords = _all_coords(self.reader)
+        if order == 'random':
+            np.random.RandomState(0).shuffle(self.coords)
+        self.nbytes = (self.reader.sizes['y'] * self.reader.sizes['x'] *
+                       np.dtype(self.reader.pixel_type).itemsize)
+
+    def teardown(self, name, memmap, order):
+        self.reader.close()
+
+    def _read_all(self):
+        for coords in self.coords:
+            self.reader.get_frame_2D(**coords)
+
+    def time_get_frame_2D(self, name, memmap, order):
+        self._read_all()
+
+    def track_frames_per_s(self, name, memmap, order):
+        return len(self.coords) / _best_time(self._read_all)
+    track_frames_per_s.unit = 'frames/s'
+
+    def track_mb_per_s(self, name, memmap, order):
+        return len(self.coords) * self.nbytes / 1e6 / _best_time(
+            self._read_all)
+    track_mb_per_s.unit = 'MB/s'
+
+
+class Bundle(object):
+    """Iterates over all frames with different bundled axes."""
+    params = [sorted(FILES), [True, False], ['yx', 'cyx', 'zyx', 'czyx']]
+    param_names = ['file', 'memmap', 'bundle_axes']
+
+    def setup(self, name, memmap, bundle_axes):
+        self.reader = ND2_Reader(FILES[name], memmap=memmap)
+        if not set(bundle_axes) <= set(self.reader.axes):
+            self.reader.close()
+            raise NotImplementedError('The file has no axes ' + bundle_axes)
+        self.reader.bundle_axes = bundle_axes
+        self.reader.iter_axes = [k for k in 'tmoz' if k in self.reader.axes
+                                 and k not in bundle_axes]
+        self.nbytes = (np.prod(self.reader.frame_shape) *
+                       np.dtype(self.reader.pixel_type).itemsize)
+
+    def teardown(self, name, memmap, bundle_axes):
+        self.reader.close()
+
+    def _read_all(self):
+        for i in range(len(self.reader)):
+            self.reader.get_frame(i)
+
+    def time_read_all(self, name, memmap, bundle_axes):
+        self._read_all()
+
+    def track_frames_per_s(self, name, memmap, bundle_axes):
+        return len(self.reader) / _best_time(self._read_all)
+    track_frames_per_s.unit = 'frames/s'
+
+    def track_mb_per_s(self, name, memmap, bundle_axes):
+        return len(self.reader) * self.nbytes / 1e6 / _best_time(
+            self._read_all)
+    track_mb_per_s.unit = 'MB/s'
+
+
+class FancyIndexing(object):
+    """Reads lists of frames: each frame twice, all frames in random order,
+    and every other frame backwards."""
+    params = [sorted(FILES), [True, False],
+              ['repeated', 'shuffled', 'strided']]
+    param_names = ['file', 'memmap', 'pattern']
+
+    def setup(self, name, memmap, pattern):
+        self.reader = ND2_Reader(FILES[name], memmap=memmap)
+        n = len(self.reader)
+        if pattern == 'repeated':
+            self.key = np.repeat(np.arange(n), 2).tolist()
+        elif pattern == 'shuffled':
+            self.key = np.random.RandomState(0).permutation(n).tolist()
+        else:
+            self.key = slice(None, None, -2)
+        self.length = len(self.reader[self.key])
+        self.nbytes = (np.prod(self.reader.frame_shape) *
+                       np.dtype(self.reader.pixel_type).itemsize)
+
+    def teardown(self, name, memmap, pattern):
+        self.reader.close()
+
+    def _read_all(self):
+        list(self.reader[self.key])
+
+    def time_fancy_indexing(self, name, memmap, pattern):
+        self._read_all()
+
+    def track_frames_per_s(self, name, memmap, pattern):
+        return self.length / _best_time(self._read_all)
+    track_frames_per_s.unit = 'frames/s'
+
+    def track_mb_per_s(self, name, memmap, pattern):
+        return self.length * self.nbytes / 1e6 / _best_time(self._read_all)
+    track_mb_per_s.unit = 'MB/s'
@@ -1,25 +1,44 @@
 from ctypes import (c_int, c_wchar, c_wchar_p, c_uint, c_size_t, c_void_p,
-                    c_double, cdll, Structure, sizeof, POINTER)
+                    c_double, cdll, Structure, Array, sizeof, POINTER)
 import os
 from sys import platform
 from datetime import datetime
-
-if platform == "linux" or platform == "linux2":
-    nd2 = cdll.LoadLibrary(os.path.join(os.path.dirname(__file__), 'ND2SDK',
-                                        'linux', 'libnd2ReadSDK.so'))
-elif platform == "darwin":
-    nd2 = cdll.LoadLibrary(os.path.join(os.path.dirname(__file__), 'ND2SDK',
-                                        'osx', 'nd2sdk.framework', 'Versions',
-                                        '1', 'nd2sdk'))
-elif platform == "win32":
-    bitsize = sizeof(c_void_p) * 8
-    if bitsize == 32:
-       dlldir = os.path.join(os.path.dirname(__file__), 'ND2SDK', 'win', 'x86')
-    elif bitsize == 64:
-       dlldir = os.path.join(os.path.dirname(__file__), 'ND2SDK', 'win', 'x64')
-    else:
-       raise OSError("The bitsize does not equal 32 or 64.")
-    nd2 = cdll.LoadLibrary(os.path.join(dlldir, 'v6_w32_nd2ReadSDK.dll'))
+from threading import Lock
+try:
+    from time import perf_counter
+except ImportError:  # Python 2
+    from time import time as perf_counter
+
+_library = []
+_library_lock = Lock()
+
+
+def _library_path():
+    sdk_dir = os.path.join(os.path.dirname(__file__), 'ND2SDK')
+    if platform == "linux" or platform == "linux2":
+        return os.path.join(sdk_dir, 'linux', 'libnd2ReadSDK.so')
+    elif platform == "darwin":
+        return os.path.join(sdk_dir, 'osx', 'nd2sdk.framework', 'Versions',
+                            '1', 'nd2sdk')
+    elif platform == "win32":
+        bitsize = sizeof(c_void_p) * 8
+        if bitsize == 32:
+            dlldir = os.path.join(sdk_dir, 'win', 'x86')
+        elif bitsize == 64:
+            dlldir = os.path.join(sdk_dir, 'win', 'x64')
+        else:
+            raise OSError("The bitsize does not equal 32 or 64.")
+        return os.path.join(dlldir, 'v6_w32_nd2ReadSDK.dll')
+    raise OSError('The ND2 SDK is not available for {}'.format(platform))
+
+
+def load_library():
+    """Loads the SDK library, once. This happens on the first call of an SDK
+    function, so that importing this module is cheap."""
+    with _library_lock:
+        if not _library:
+            _library.append(cdll.LoadLibrary(_library_path()))
+    return _library[0]
 
 
 def jdn_to_datetime_local(jdn):
@@ -51,6 +70,9 @@ LIMMAXEXPERIMENTLEVEL = 8
 LIMSTRETCH_QUICK = 1
 LIMSTRETCH_SPLINES = 2
 LIMSTRETCH_LINEAR = 3
+STRETCH_MODES = {'quick': LIMSTRETCH_QUICK,
+                 'splines': LIMSTRETCH_SPLINES,
+                 'linear': LIMSTRETCH_LINEAR}
 
 LIM_ERR = {0:  'LIM_OK',
            -1:  'LIM_ERR_UNEXPECTED',
@@ -83,6 +105,42 @@ def rgb_int_to_float_tuple(rgb):
             (rgb >> 16 & 255) / 255.)
 
 
+def struct_to_dict(struct):
+    """Converts a ctypes Structure into a dict of python values."""
+    result = dict()
+    for name, _ in struct._fields_:
+        value = getattr(struct, name)
+        if isinstance(value, Structure):
+            value = struct_to_dict(value)
+        elif isinstance(value, Array):
+            value = [struct_to_dict(v) if isinstance(v, Structure) else v
+                     for v in value]
+        result[name] = value
+    return result
+
+
+def struct_from_dict(struct, values):
+    """Fills a ctypes Structure with the values of a dict, as returned by
+    `struct_to_dict`. Arrays may be shorter than the fields they fill."""
+    for name, ctype in struct._fields_:
+        if name not in values:
+            continue
+        value = values[name]
+        if issubclass(ctype, Structure):
+            struct_from_dict(getattr(struct, name), value)
+        elif issubclass(ctype, Array) and issubclass(ctype._type_, Structure):
+            field = getattr(struct, name)
+            for i, v in enumerate(value):
+                struct_from_dict(field[i], v)
+        elif issubclass(ctype, Array) and ctype._type_ is not LIMWCHAR:
+            field = getattr(struct, name)
+            for i, v in enumerate(value):
+                field[i] = v
+        else:
+            setattr(struct, name, value)
+    return struct
+
+
 def LIMRESULT(result):
     if result != 0:
         error = LIM_ERR[result]
@@ -172,7 +230,8 @@ class LIMTEXTINFO(Structure):
                 ("wszConclusion", LIMWCHAR * 256),
                 ("wszInfo1", LIMWCHAR * 256),
                 ("wszInfo2", LIMWCHAR * 256),
-                ("wszOptics", LIMWCHAR * 256)]
+                ("wszOptics", LIMWCHAR * 256),
+                ("wszAppVersion", LIMWCHAR * 256)] # written by the SDK too
 
 
 class LIMEXPERIMENTLEVEL(Structure):
@@ -193,98 +252,151 @@ class LIMLOCALMETADATA(Structure):
                 ("dZPos", c_double)]
 
 
-Lim_FileOpenForRead = nd2.Lim_FileOpenForRead
-Lim_FileOpenForRead.argtypes = [LIMCWSTR]
-Lim_FileOpenForRead.restype = LIMFILEHANDLE
-
-Lim_FileGetAttributes = nd2.Lim_FileGetAttributes
-Lim_FileGetAttributes.argtypes = [LIMFILEHANDLE, POINTER(LIMATTRIBUTES)]
-Lim_FileGetAttributes.restype = LIMRESULT
-
-Lim_FileGetMetadata = nd2.Lim_FileGetMetadata
-Lim_FileGetMetadata.argtypes = [LIMFILEHANDLE, POINTER(LIMMETADATA_DESC)]
-Lim_FileGetMetadata.restype = LIMRESULT
-
-Lim_FileGetTextinfo = nd2.Lim_FileGetTextinfo
-Lim_FileGetTextinfo.argtypes = [LIMFILEHANDLE, POINTER(LIMTEXTINFO)]
-Lim_FileGetTextinfo.restype = LIMRESULT
-
-Lim_FileGetExperiment = nd2.Lim_FileGetExperiment
-Lim_FileGetExperiment.argtypes = [LIMFILEHANDLE, POINTER(LIMEXPERIMENT)]
-Lim_FileGetExperiment.restype = LIMRESULT
-
-Lim_FileGetImageData = nd2.Lim_FileGetImageData
-Lim_FileGetImageData.argtypes = [LIMFILEHANDLE, LIMUINT, POINTER(LIMPICTURE),
-                                 POINTER(LIMLOCALMETADATA)]
-Lim_FileGetImageData.restype = LIMRESULT
-
-Lim_FileGetImageRectData = nd2.Lim_FileGetImageRectData
-Lim_FileGetImageRectData.argtypes = [LIMFILEHANDLE, LIMUINT, LIMUINT,
-                                     LIMUINT, LIMUINT, LIMUINT, LIMUINT,
-                                     LIMUINT, c_void_p, LIMUINT, LIMINT,
-                                     POINTER(LIMLOCALMETADATA)]
-Lim_FileGetImageRectData.restype = LIMRESULT
-
-Lim_FileGetBinaryDescriptors = nd2.Lim_FileGetBinaryDescriptors
-Lim_FileGetBinaryDescriptors.argtypes = [LIMFILEHANDLE, POINTER(LIMBINARIES)]
-Lim_FileGetBinaryDescriptors.restype = LIMRESULT
-
-Lim_FileGetBinary = nd2.Lim_FileGetBinary
-Lim_FileGetBinary.argtypes = [LIMFILEHANDLE, LIMUINT, LIMUINT,
-                              POINTER(LIMPICTURE)]
-Lim_FileGetBinary.restype = LIMRESULT
-
-Lim_FileClose = nd2.Lim_FileClose
-Lim_FileClose.argtypes = [LIMFILEHANDLE]
-Lim_FileClose.restype = LIMRESULT
-
-
-Lim_InitPicture = nd2.Lim_InitPicture
-Lim_InitPicture.argtypes = [POINTER(LIMPICTURE),
-                            LIMUINT, LIMUINT, LIMUINT, LIMUINT]
-Lim_InitPicture.restype = LIMSIZE
-
-Lim_DestroyPicture = nd2.Lim_DestroyPicture
-Lim_DestroyPicture.argtypes = [POINTER(LIMPICTURE)]
-
-Lim_GetSeqIndexFromCoords = nd2.Lim_GetSeqIndexFromCoords
-Lim_GetSeqIndexFromCoords.argtypes = [POINTER(LIMEXPERIMENT),
-                                      POINTER(LIMUINT * 4)]
-Lim_GetSeqIndexFromCoords.restype = LIMUINT
-
-Lim_GetCoordsFromSeqIndex = nd2.Lim_GetCoordsFromSeqIndex
-Lim_GetCoordsFromSeqIndex.argtypes = [POINTER(LIMEXPERIMENT), LIMUINT,
-                                      POINTER(LIMUINT)]
-
-Lim_GetMultipointName = nd2.Lim_GetMultipointName
-Lim_GetMultipointName.argtypes = [LIMFILEHANDLE, LIMUINT, LIMWSTR]
-Lim_GetMultipointName.restype = LIMRESULT
-
-Lim_GetLargeImageDimensions = nd2.Lim_GetLargeImageDimensions
-Lim_GetLargeImageDimensions.argtypes = [LIMFILEHANDLE, POINTER(LIMUINT),
-                                        POINTER(LIMUINT), POINTER(c_double)]
-Lim_GetLargeImageDimensions.restype = LIMRESULT
-
-Lim_GetRecordedDataInt = nd2.Lim_GetRecordedDataInt
-Lim_GetRecordedDataInt.argtypes = [LIMFILEHANDLE, LIMCWSTR,
-                                   LIMINT, POINTER(LIMINT)]
-Lim_GetRecordedDataInt.restype = LIMRESULT
-
-Lim_GetRecordedDataDouble = nd2.Lim_GetRecordedDataDouble
-Lim_GetRecordedDataDouble.argtypes = [LIMFILEHANDLE, LIMCWSTR,
-                                      LIMINT, POINTER(c_double)]
-Lim_GetRecordedDataDouble.restype = LIMRESULT
-
-Lim_GetRecordedDataString = nd2.Lim_GetRecordedDataString
-Lim_GetRecordedDataString.argtypes = [LIMFILEHANDLE, LIMCWSTR,
-                                      LIMINT, LIMWSTR]
-Lim_GetRecordedDataString.restype = LIMRESULT
-
-Lim_GetNextUserEvent = nd2.Lim_GetNextUserEvent
-Lim_GetNextUserEvent.argtypes = [LIMFILEHANDLE, POINTER(LIMUINT),
-                                 POINTER(LIMFILEUSEREVENT)]
-Lim_GetNextUserEvent.restype = LIMRESULT
-
-Lim_GetZStackHome = nd2.Lim_GetZStackHome
-Lim_GetZStackHome.argtypes = [LIMFILEHANDLE]
-Lim_GetZStackHome.restype = LIMINT
+class _LazyFunction(object):
+    """SDK function that is looked up in the library on its first call."""
+    def __init__(self, name, argtypes, restype):
+        self.__name__ = str(name)
+        self._argtypes = argtypes
+        self._restype = restype
+        self._func = None
+
+    def bind(self):
+        """Returns the ctypes function, loading the library if needed."""
+        if self._func is None:
+            func = getattr(load_library(), self.__name__)
+            func.argtypes = self._argtypes
+            func.restype = self._restype
+            self._func = func
+            # later lookups in this module skip the indirection, unless the
+            # function is wrapped (see instrument)
+            if globals().get(self.__name__) is self:
+                globals()[self.__name__] = func
+            _SDK_FUNCTIONS[self.__name__] = func
+        return self._func
+
+    def __call__(self, *args):
+        return self.bind()(*args)
+
+
+def _bind(name, argtypes, restype=c_int):
+    return _LazyFunction(name, argtypes, restype)
+
+
+Lim_FileOpenForRead = _bind('Lim_FileOpenForRead', [LIMCWSTR], LIMFILEHANDLE)
+
+Lim_FileGetAttributes = _bind('Lim_FileGetAttributes',
+                              [LIMFILEHANDLE, POINTER(LIMATTRIBUTES)],
+                              LIMRESULT)
+
+Lim_FileGetMetadata = _bind('Lim_FileGetMetadata',
+                            [LIMFILEHANDLE, POINTER(LIMMETADATA_DESC)],
+                            LIMRESULT)
+
+Lim_FileGetTextinfo = _bind('Lim_FileGetTextinfo',
+                            [LIMFILEHANDLE, POINTER(LIMTEXTINFO)],
+                            LIMRESULT)
+
+Lim_FileGetExperiment = _bind('Lim_FileGetExperiment',
+                              [LIMFILEHANDLE, POINTER(LIMEXPERIMENT)],
+                              LIMRESULT)
+
+Lim_FileGetImageData = _bind('Lim_FileGetImageData',
+                             [LIMFILEHANDLE, LIMUINT, POINTER(LIMPICTURE),
+                              POINTER(LIMLOCALMETADATA)],
+                             LIMRESULT)
+
+Lim_FileGetImageRectData = _bind('Lim_FileGetImageRectData',
+                                 [LIMFILEHANDLE, LIMUINT, LIMUINT, LIMUINT,
+                                  LIMUINT, LIMUINT, LIMUINT, LIMUINT, c_void_p,
+                                  LIMUINT, LIMINT, POINTER(LIMLOCALMETADATA)],
+                                 LIMRESULT)
+
+Lim_FileGetBinaryDescriptors = _bind('Lim_FileGetBinaryDescriptors',
+                                     [LIMFILEHANDLE, POINTER(LIMBINARIES)],
+                                     LIMRESULT)
+
+Lim_FileGetBinary = _bind('Lim_FileGetBinary',
+                          [LIMFILEHANDLE, LIMUINT, LIMUINT,
+                           POINTER(LIMPICTURE)],
+                          LIMRESULT)
+
+Lim_FileClose = _bind('Lim_FileClose', [LIMFILEHANDLE], LIMRESULT)
+
+Lim_InitPicture = _bind('Lim_InitPicture',
+                        [POINTER(LIMPICTURE), LIMUINT, LIMUINT, LIMUINT,
+                         LIMUINT],
+                        LIMSIZE)
+
+Lim_DestroyPicture = _bind('Lim_DestroyPicture', [POINTER(LIMPICTURE)])
+
+Lim_GetSeqIndexFromCoords = _bind('Lim_GetSeqIndexFromCoords',
+                                  [POINTER(LIMEXPERIMENT),
+                                   POINTER(LIMUINT * 4)],
+                                  LIMUINT)
+
+Lim_GetCoordsFromSeqIndex = _bind('Lim_GetCoordsFromSeqIndex',
+                                  [POINTER(LIMEXPERIMENT), LIMUINT,
+                                   POINTER(LIMUINT)])
+
+Lim_GetMultipointName = _bind('Lim_GetMultipointName',
+                              [LIMFILEHANDLE, LIMUINT, LIMWSTR],
+                              LIMRESULT)
+
+Lim_GetLargeImageDimensions = _bind('Lim_GetLargeImageDimensions',
+                                    [LIMFILEHANDLE, POINTER(LIMUINT),
+                                     POINTER(LIMUINT), POINTER(c_double)],
+                                    LIMRESULT)
+
+Lim_GetRecordedDataInt = _bind('Lim_GetRecordedDataInt',
+                               [LIMFILEHANDLE, LIMCWSTR, LIMINT,
+                                POINTER(LIMINT)],
+                               LIMRESULT)
+
+Lim_GetRecordedDataDouble = _bind('Lim_GetRecordedDataDouble',
+                                  [LIMFILEHANDLE, LIMCWSTR, LIMINT,
+                                   POINTER(c_double)],
+                                  LIMRESULT)
+
+Lim_GetRecordedDataString = _bind('Lim_GetRecordedDataString',
+                                  [LIMFILEHANDLE, LIMCWSTR, LIMINT, LIMWSTR],
+                                  LIMRESULT)
+
+Lim_GetNextUserEvent = _bind('Lim_GetNextUserEvent',
+                             [LIMFILEHANDLE, POINTER(LIMUINT),
+                              POINTER(LIMFILEUSEREVENT)],
+                             LIMRESULT)
+
+Lim_GetZStackHome = _bind('Lim_GetZStackHome', [LIMFILEHANDLE], LIMINT)
+
+
+# instrumentation: the SDK functions above can be replaced by timed wrappers
+_SDK_FUNCTIONS = dict((k, v) for k, v in globals().items()
+                      if k.startswith('Lim_'))
+# number of bytes written by SDK functions that return pixel data
+_SDK_NBYTES = {'Lim_FileGetImageData':
+                   lambda args: getattr(args[2], 'uiSize', 0),
+               'Lim_FileGetImageRectData': lambda args: args[7] * args[9]}
+
+
+def _timed(name, func, callback):
+    nbytes = _SDK_NBYTES.get(name)
+
+    def wrapper(*args):
+        start = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            callback(name, perf_counter() - start,
+                     0 if nbytes is None else nbytes(args))
+    wrapper.__name__ = str(name)
+    return wrapper
+
+
+def instrument(callback=None):
+    """Replaces the SDK functions of this module by wrappers that call
+    `callback(name, seconds, nbytes)` after each call. Without callback, the
+    original functions are restored, so that there is no overhead."""
+    for name, func in _SDK_FUNCTIONS.items():
+        if callback is not None:
+            func = _timed(name, func, callback)
+        globals()[name] = func
@@ -1 +1,10 @@
 from .nd2reader import ND2_Reader
+from .preview import preview_pyramid
+from .convert import convert
+from .stats import ReadStats, record_stats
+from .dataset import ND2_Dataset
+from .projection import ND2_Projection
+try:  # Python 3.8+
+    from .server import ND2_FrameServer, ND2_FrameClient
+except ImportError:
+    pass
@@ -0,0 +1,18 @@
+"""Coroutine of the asyncio test (Python 3.7+). It is kept out of test.py,
+which has to parse on all supported Python versions.
+"""
+import asyncio
+from .nd2reader import ND2_Reader
+
+
+async def read(filename):
+    """Reads cluster.nd2 with all asyncio methods of ND2_Reader. Returns
+    frames 2, 0 and 1, all frames iterated over, the plane at t=1, z=3,
+    c=0, and the first frame of `aiter_frames([1, 2])`."""
+    with ND2_Reader(filename, handles=2, memmap=False) as v:
+        frames = await asyncio.gather(*[v.aget_frame(i) for i in (2, 0, 1)])
+        iterated = [frame async for frame in v]
+        plane = await v.aget_frame_2D(t=1, z=3, c=0)
+        async for frame in v.aiter_frames([1, 2], ahead=1):
+            break
+    return frames, iterated, plane, frame
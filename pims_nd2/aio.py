@@ -0,0 +1,68 @@
+"""asyncio interface of ND2_Reader (Python 3.7+).
+
+SDK reads block for the time it takes to decode a picture. These coroutines
+run them on the executor of the reader instead, which has one thread per SDK
+handle (see the `handles` parameter of ND2_Reader), so that the event loop
+keeps running.
+"""
+import asyncio
+from collections import deque
+from functools import partial
+
+# maximum number of reads per SDK handle that are queued or running, per
+# reader and event loop; further reads wait without using the executor
+MAX_PENDING_PER_HANDLE = 4
+
+
+def _limit(reader, loop):
+    limits = reader._async_limits
+    semaphore = limits.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_PENDING_PER_HANDLE *
+                                      reader._pool.size)
+        limits[loop] = semaphore
+    return semaphore
+
+
+async def _run(reader, func, *args, **kwargs):
+    """Runs `func` on the executor of the reader. Cancelling the coroutine
+    cancels the read if it did not start yet."""
+    loop = asyncio.get_running_loop()
+    async with _limit(reader, loop):
+        return await loop.run_in_executor(reader._get_executor(),
+                                          partial(func, *args, **kwargs))
+
+
+async def aget_frame(reader, i):
+    """Returns frame `i` of `reader`, see `ND2_Reader.aget_frame`."""
+    return await _run(reader, reader.get_frame, i)
+
+
+async def aget_frame_2D(reader, **coords):
+    """Returns the plane at `coords`, see `ND2_Reader.aget_frame_2D`."""
+    return await _run(reader, reader.get_frame_2D, **coords)
+
+
+async def aiter_frames(reader, indices=None, ahead=None):
+    """Yields the frames `indices` of `reader` in order, see
+    `ND2_Reader.aiter_frames`."""
+    if indices is None:
+        indices = range(len(reader))
+    if ahead is None:
+        ahead = reader._pool.size
+    ahead = max(int(ahead), 1)
+    loop = asyncio.get_running_loop()
+    executor = reader._get_executor()
+    pending = deque()
+    try:
+        for i in indices:
+            pending.append(loop.run_in_executor(executor, reader.get_frame,
+                                                int(i)))
+            if len(pending) >= ahead:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        # the consumer stopped early or was cancelled: drop queued reads
+        for future in pending:
+            future.cancel()
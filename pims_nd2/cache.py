@@ -0,0 +1,79 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import OrderedDict
+from threading import RLock
+
+
+class PlaneCache(object):
+    """Least recently used cache of decoded pictures, bounded in bytes.
+
+    Values are (ndarray, metadata) tuples. The arrays are made read-only, so
+    that a cached picture cannot be changed by accident.
+
+    Parameters
+    ----------
+    maxbytes : int
+        Memory budget in bytes. Pictures larger than this are not cached.
+
+    Attributes
+    ----------
+    hits : int
+        Number of successful lookups
+    misses : int
+        Number of failed lookups
+    nbytes : int
+        Number of bytes currently in the cache
+    """
+    def __init__(self, maxbytes):
+        self.maxbytes = int(maxbytes)
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key):
+        """Returns the (ndarray, metadata) tuple at `key`, or None."""
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = value  # mark as most recently used
+            self.hits += 1
+            return value
+
+    def put(self, key, arr, metadata=None):
+        """Stores a copy of `arr` at `key`, evicting least recently used
+        pictures when the memory budget is exceeded."""
+        if arr.nbytes > self.maxbytes:
+            return
+        arr = arr.copy()
+        arr.flags.writeable = False
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[0].nbytes
+            while self._data and self.nbytes + arr.nbytes > self.maxbytes:
+                _, (evicted, _) = self._data.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+            self._data[key] = (arr, metadata)
+            self.nbytes += arr.nbytes
+
+    def clear(self):
+        """Empties the cache. Hit and miss counters are kept."""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __repr__(self):
+        return ('<PlaneCache: {} pictures, {}/{} bytes, {} hits, '
+                '{} misses>'.format(len(self), self.nbytes, self.maxbytes,
+                                    self.hits, self.misses))
@@ -0,0 +1,205 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from multiprocessing import cpu_count
+import numpy as np
+from .nd2reader import ND2_Reader
+from .dask_array import DASK_AXES
+
+FRAME_TABLE_FIELDS = ('t_ms', 'x_um', 'y_um', 'z_um')
+
+
+def _to_json(value):
+    """Converts metadata values into json-serializable values."""
+    if isinstance(value, dict):
+        return dict((str(k), _to_json(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+class _ZarrWriter(object):
+    def __init__(self, output, overwrite):
+        try:
+            import zarr
+        except ImportError:
+            raise ImportError('Converting to zarr requires zarr, please '
+                              'install it with "pip install zarr"')
+        self.group = zarr.open_group(output, mode='w' if overwrite else 'w-')
+
+    def _create(self, name, **kwargs):
+        create = getattr(self.group, 'create_array', None)
+        if create is None:  # zarr 2
+            create = self.group.create_dataset
+        return create(name, **kwargs)
+
+    def create_image(self, shape, dtype, chunks):
+        return self._create('image', shape=shape, dtype=dtype, chunks=chunks)
+
+    def add_array(self, name, data):
+        self._create(name, data=data)
+
+    def set_attrs(self, attrs):
+        self.group.attrs.update(attrs)
+
+    def close(self):
+        pass
+
+
+class _HDF5Writer(object):
+    def __init__(self, output, overwrite, compression='gzip'):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('Converting to HDF5 requires h5py, please '
+                              'install it with "pip install h5py"')
+        self.file = h5py.File(output, 'w' if overwrite else 'w-')
+        self.compression = compression
+
+    def create_image(self, shape, dtype, chunks):
+        return self.file.create_dataset('image', shape=shape, dtype=dtype,
+                                        chunks=chunks,
+                                        compression=self.compression)
+
+    def add_array(self, name, data):
+        self.file.create_dataset(name, data=data)
+
+    def set_attrs(self, attrs):
+        import json
+        for k, v in attrs.items():
+            if not isinstance(v, (str, int, float)):
+                v = json.dumps(v)
+            self.file.attrs[k] = v
+
+    def close(self):
+        self.file.close()
+
+
+def convert(filename, output, format=None, workers=None, overwrite=False,
+            **kwargs):
+    """Converts an ND2 file into a chunked zarr or HDF5 store.
+
+    The image is stored in the dataset 'image', with axes t, m, o, z, c, y, x
+    (absent axes are left out) and one SDK picture per chunk. Pictures are
+    decoded in parallel threads, each with its own SDK handle, and every
+    picture is decoded and written once, with all its channels. At most a
+    few pictures per worker are held in memory, regardless of the file size.
+
+    The reader metadata, the axes and the metadata text are stored as
+    attributes. The coordinates, times and stage positions of all pictures
+    are stored in the datasets 'frame_table/<field>'.
+
+    Parameters
+    ----------
+    filename : str
+    output : str
+        Path of the zarr directory or HDF5 file.
+    format : {'zarr', 'hdf5'}, optional
+        Output format. By default, it follows from the extension of
+        `output`: '.h5' and '.hdf5' give HDF5, anything else zarr.
+    workers : int, optional
+        Number of decoding threads. Defaults to the number of CPUs.
+    overwrite : bool, optional
+        Whether to replace an existing output. Defaults to False.
+    kwargs :
+        Passed on to ND2_Reader, e.g. roi or scale.
+    """
+    if format is None:
+        ext = os.path.splitext(output)[1].lower()
+        format = 'hdf5' if ext in ('.h5', '.hdf5') else 'zarr'
+    if workers is None:
+        workers = cpu_count()
+
+    with ND2_Reader(filename, handles=workers, **kwargs) as reader:
+        if format == 'zarr':
+            writer = _ZarrWriter(output, overwrite)
+        elif format == 'hdf5':
+            writer = _HDF5Writer(output, overwrite)
+        else:
+            raise ValueError('Unknown format "{}"'.format(format))
+        try:
+            _convert(reader, writer, workers)
+        finally:
+            writer.close()
+
+
+def _convert(reader, writer, workers):
+    axes = [k for k in DASK_AXES if k in reader.sizes]
+    shape = tuple(reader.sizes[k] for k in axes)
+    chunks = tuple(1 if k in 'tmoz' else reader.sizes[k] for k in axes)
+    image = writer.create_image(shape, reader.pixel_type, chunks)
+
+    # position of each picture in the image, in the order of `axes`
+    coords_table = reader.coords_table
+    loop_axes = [k for k in axes if k in 'tmoz']
+    positions = coords_table[:, ['tmzo'.index(k) for k in loop_axes]]
+    multichannel = 'c' in axes
+    # the times and stage positions come with the pixels: the frame table
+    # is filled while decoding, instead of in an extra pass over the file
+    n = len(coords_table)
+    local_md = dict((k, np.empty(n, np.float64)) for k in FRAME_TABLE_FIELDS)
+
+    def read(i):
+        picture = np.empty(reader._lim_frame_shape, reader.pixel_type)
+        md = reader._read_seq_index_into(i, picture)
+        if multichannel:
+            picture = np.moveaxis(picture, -1, 0)
+        return picture, md
+
+    def write(j, future):
+        picture, md = future.result()
+        image[tuple(positions[j])] = picture
+        for k in FRAME_TABLE_FIELDS:
+            local_md[k][j] = md[k]
+
+    # keep a bounded number of pictures in flight; write in the main thread
+    max_pending = 2 * workers
+    pending = deque()
+    with ThreadPoolExecutor(workers) as executor:
+        for i in range(n):
+            if len(pending) >= max_pending:
+                write(*pending.popleft())
+            pending.append((i, executor.submit(read, i)))
+        while pending:
+            write(*pending.popleft())
+
+    writer.add_array('frame_table/seq_index', np.arange(n))
+    for j, k in enumerate('tmzo'):
+        writer.add_array('frame_table/' + k,
+                         np.ascontiguousarray(coords_table[:, j]))
+    for k in FRAME_TABLE_FIELDS:
+        writer.add_array('frame_table/' + k, local_md[k])
+    writer.set_attrs({'axes': axes,
+                      'source': os.path.abspath(reader.filename),
+                      'metadata': _to_json(reader.metadata),
+                      'metadata_text': reader.metadata_text,
+                      'roi': _to_json(reader.roi),
+                      'scale': reader.scale})
+
+
+def main(argv=None):
+    """Command line entry point of the ND2 converter."""
+    parser = argparse.ArgumentParser(
+        description='Convert an ND2 file into a chunked zarr or HDF5 store.')
+    parser.add_argument('filename', help='ND2 file')
+    parser.add_argument('output', help='zarr directory or HDF5 (.h5) file')
+    parser.add_argument('--format', choices=('zarr', 'hdf5'), default=None,
+                        help='output format (default: from the extension)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of decoding threads (default: #CPUs)')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='replace an existing output')
+    args = parser.parse_args(argv)
+    convert(args.filename, args.output, format=args.format,
+            workers=args.workers, overwrite=args.overwrite)
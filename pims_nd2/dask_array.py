@@ -0,0 +1,138 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import atexit
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+from threading import Lock
+import numpy as np
+
+# axis order of the dask array; axes that are not in the file are left out
+DASK_AXES = 'tmozcyx'
+# maximum number of open readers per process
+MAX_READERS = 4
+
+# open readers of this process, shared by all tasks, least recently used
+# first
+_readers = OrderedDict()
+_in_use = dict()
+_readers_lock = Lock()
+
+
+@contextmanager
+def _get_reader(source):
+    """Context manager that borrows an open reader for `source`, opening it
+    once per process. The least recently used readers that are not in use
+    are closed when more than MAX_READERS are open."""
+    from .nd2reader import ND2_Reader
+    key = (os.getpid(), source)
+    with _readers_lock:
+        reader = _readers.pop(key, None)
+        if reader is not None:
+            _readers[key] = reader  # most recently used
+            _in_use[key] = _in_use.get(key, 0) + 1
+    if reader is None:
+        # open outside the lock, so that tasks on open readers do not wait
+        filename, roi, scale, stretch = source
+        reader = ND2_Reader(filename, roi=roi, scale=scale, stretch=stretch,
+                            handles=cpu_count())
+        with _readers_lock:
+            other = _readers.pop(key, None)
+            if other is not None:  # opened by another task meanwhile
+                duplicate, reader = reader, other
+            else:
+                duplicate = None
+            _readers[key] = reader
+            _in_use[key] = _in_use.get(key, 0) + 1
+        if duplicate is not None:
+            duplicate.close()
+    try:
+        yield reader
+    finally:
+        with _readers_lock:
+            _in_use[key] -= 1
+            if _in_use[key] == 0:
+                del _in_use[key]
+            to_close = []
+            for k in list(_readers):
+                if len(_readers) <= MAX_READERS:
+                    break
+                if k not in _in_use:
+                    to_close.append(_readers.pop(k))
+        for old in to_close:
+            old.close()
+
+
+def close_readers(sources=None):
+    """Closes the open readers of this process for `sources`, or all of
+    them. Called when the reader that made the dask array is closed, and at
+    exit."""
+    with _readers_lock:
+        keys = [k for k in _readers if sources is None or k[1] in sources]
+        to_close = [_readers.pop(k) for k in keys]
+    for reader in to_close:
+        reader.close()
+
+atexit.register(close_readers)
+
+
+class ND2Array(object):
+    """Array-like view on all pictures of an ND2 file, for `dask.array`.
+    It supports indexing with a tuple of slices only.
+
+    Only the file name and reading options are stored, so that instances
+    pickle cheaply. The file is opened once per process, on first access.
+    """
+    def __init__(self, reader):
+        roi = reader.roi if reader.roi is None else tuple(reader.roi)
+        self.source = (reader.filename, roi, reader.scale, reader._stretch)
+        self.axes = [k for k in DASK_AXES if k in reader.sizes]
+        self.shape = tuple(reader.sizes[k] for k in self.axes)
+        self.dtype = np.dtype(reader.pixel_type)
+        self.ndim = len(self.shape)
+
+    def __getitem__(self, key):
+        with _get_reader(self.source) as reader:
+            return self._read(reader, key)
+
+    def _read(self, reader, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        slices = dict(zip(self.axes, key))
+        ranges = dict((k, np.arange(size)[slices[k]])
+                      for k, size in zip(self.axes, self.shape))
+
+        # read all pictures in the block in one go, in (..., y, x, c) order
+        loop_axes = [k for k in self.axes if k in 'tmoz']
+        coords = dict(zip(loop_axes,
+                          np.ix_(*[ranges[k] for k in loop_axes])))
+        seq_indices = np.ravel(reader.get_seq_index(**coords))
+        pictures = reader.get_frames(seq_indices)
+        block_shape = tuple(len(ranges[k]) for k in loop_axes)
+        pictures = pictures.reshape(block_shape + pictures.shape[1:])
+        if 'c' in self.axes:
+            pictures = np.moveaxis(pictures, -1, -3)[..., slices['c'], :, :]
+        return pictures[..., slices['y'], slices['x']]
+
+
+def to_dask(reader, chunks=None):
+    """Returns a lazy dask array over all axes of an ND2 file, see
+    `ND2_Reader.to_dask`."""
+    try:
+        import dask.array as da
+    except ImportError:
+        raise ImportError('to_dask requires dask, please install it with '
+                          '"pip install dask[array]"')
+    arr = ND2Array(reader)
+    reader._dask_sources.add(arr.source)
+    if chunks is None or isinstance(chunks, dict):
+        # default: one SDK picture (with all channels) per chunk
+        sizes = dict((k, 1 if k in 'tmoz' else reader.sizes[k])
+                     for k in arr.axes)
+        sizes.update(chunks or dict())
+        chunks = tuple(sizes[k] for k in arr.axes)
+    return da.from_array(arr, chunks=chunks, asarray=False, fancy=False,
+                         meta=np.empty((0,) * arr.ndim, dtype=arr.dtype))
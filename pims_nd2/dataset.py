@@ -0,0 +1,192 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import glob
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from pims.base_frames import FramesSequenceND
+from .nd2reader import ND2_Reader
+
+
+class ND2_Dataset(FramesSequenceND):
+    """Reads many ND2 files with the same axes and sizes, e.g. all wells of a
+    plate, as one multidimensional image with an extra file axis 'f'.
+
+    Only a bounded number of files is open at the same time. Files are opened
+    when their frames are read, and the least recently used file is closed
+    when the limit is reached. With `index_cache`, the sizes of a file are
+    taken from its index (see ND2_Reader), so that reopening a file does not
+    query the SDK until pixels are read.
+
+    Parameters
+    ----------
+    filenames : list of str or str
+        The ND2 files, or a glob pattern. Files of a pattern are sorted.
+    max_open : int, optional
+        Maximum number of files that are open at the same time. Defaults
+        to 8.
+    series : int, optional
+        Default series (multipoint position)
+    channel : int, optional
+        Default channel
+    kwargs :
+        Passed on to ND2_Reader, e.g. roi, scale or index_cache.
+
+    Attributes
+    ----------
+    filenames : list of str
+        The file of each coordinate along the 'f' axis.
+    open_files : list of int
+        The files that are open at the moment.
+    metadata : dict
+        The metadata of the first file, and the list of files.
+    axes, sizes, iter_axes, bundle_axes, default_coords :
+        See ND2_Reader. The 'f' axis is iterated over first by default.
+
+    Examples
+    ----------
+    >>> with ND2_Dataset('plate1/*.nd2', max_open=16) as frames:
+    ...     frames.iter_axes = 'ft'
+    ...     for frame in frames:
+    ...         print(frame.metadata['filename'], frame.metadata['t'])
+    """
+    def __init__(self, filenames, max_open=8, series=0, channel=0,
+                 **kwargs):
+        super(ND2_Dataset, self).__init__()
+        if not isinstance(filenames, (list, tuple)):
+            filenames = sorted(glob.glob(filenames))
+        if len(filenames) == 0:
+            raise IOError('No files to read.')
+        if max_open < 1:
+            raise ValueError('max_open should be at least 1.')
+        self.filenames = [str(f) for f in filenames]
+        self.max_open = int(max_open)
+        self._kwargs = kwargs
+        self._readers = OrderedDict()  # open readers, least recent first
+        self._in_use = dict()
+        self._lock = Lock()
+        self._closed = False
+        self._file_sizes = None
+
+        with self._reader(0) as reader:
+            self._file_sizes = dict(reader.sizes)
+            self._pixel_type = reader.pixel_type
+
+        self._init_axis('f', len(self.filenames))
+        for k, size in self._file_sizes.items():
+            self._init_axis(k, size)
+
+        self._register_get_frame(self.get_frame_2D, 'yx')
+        if 'c' in self.axes:
+            self._register_get_frame(self.get_frame_cyx, 'cyx')
+        if 'z' in self.axes:
+            self.bundle_axes = 'zyx'
+        self.iter_axes = [k for k in 'ft' if k in self.axes]
+        if 'm' in self.axes:
+            self.default_coords['m'] = series
+        if 'c' in self.axes:
+            self.default_coords['c'] = channel
+
+    @contextmanager
+    def _reader(self, f):
+        """Context manager that borrows the reader of file `f`, and opens it
+        if needed. Readers in use are never closed."""
+        with self._lock:
+            if self._closed:
+                raise IOError('Dataset is closed, unable to read data')
+            reader = self._readers.pop(f, None)
+            if reader is not None:
+                self._readers[f] = reader  # most recently used
+                self._in_use[f] = self._in_use.get(f, 0) + 1
+        if reader is None:
+            reader = self._open(f)
+        try:
+            yield reader
+        finally:
+            with self._lock:
+                self._in_use[f] -= 1
+                if self._in_use[f] == 0:
+                    del self._in_use[f]
+                to_close = self._evict()
+            for old in to_close:
+                old.close()
+
+    def _open(self, f):
+        reader = ND2_Reader(self.filenames[f], **self._kwargs)
+        if (self._file_sizes is not None and
+                reader.sizes != self._file_sizes):
+            sizes = dict(reader.sizes)
+            reader.close()
+            raise ValueError('The sizes {} of "{}" differ from the sizes {} '
+                             'of the dataset'.format(sizes, self.filenames[f],
+                                                     self._file_sizes))
+        with self._lock:
+            other = self._readers.pop(f, None)
+            if other is not None:  # opened by another thread meanwhile
+                reader.close()
+                reader = other
+            self._readers[f] = reader
+            self._in_use[f] = self._in_use.get(f, 0) + 1
+        return reader
+
+    def _evict(self):
+        """Removes the least recently used readers that are not in use, until
+        at most `max_open` are open. Returns the readers to close."""
+        to_close = []
+        for f in list(self._readers):
+            if len(self._readers) <= self.max_open:
+                break
+            if f not in self._in_use:
+                to_close.append(self._readers.pop(f))
+        return to_close
+
+    @property
+    def open_files(self):
+        """The indices of the files that are open, least recently used
+        first."""
+        with self._lock:
+            return list(self._readers)
+
+    def _read(self, method, coords):
+        f = int(coords.pop('f'))
+        with self._reader(f) as reader:
+            frame = getattr(reader, method)(**coords)
+        frame.metadata['f'] = f
+        frame.metadata['filename'] = self.filenames[f]
+        return frame
+
+    def get_frame_2D(self, **coords):
+        return self._read('get_frame_2D', coords)
+
+    def get_frame_cyx(self, **coords):
+        return self._read('get_frame_cyx', coords)
+
+    def get_reader(self, f):
+        """Returns a context manager that borrows the ND2_Reader of file `f`,
+        e.g. to use its metadata or `read_block`."""
+        return self._reader(f)
+
+    @property
+    def metadata(self):
+        """The metadata of the first file, and the list of files."""
+        with self._reader(0) as reader:
+            metadata = reader.metadata
+        metadata['filenames'] = self.filenames
+        return metadata
+
+    @property
+    def pixel_type(self):
+        return self._pixel_type
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            readers = list(self._readers.values())
+            self._readers.clear()
+        for reader in readers:
+            reader.close()
+
+    def __del__(self):
+        if hasattr(self, '_readers'):
+            self.close()
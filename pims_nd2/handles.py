@@ -0,0 +1,102 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+from contextlib import contextmanager
+from threading import Lock
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+from . import ND2SDK as h
+
+
+def open_handle(filename):
+    """Opens an ND2 file with the SDK and returns the file handle."""
+    handle = h.Lim_FileOpenForRead(os.path.abspath(filename))
+    if not handle:
+        raise IOError('The file "{}" could not be opened.'.format(filename))
+    return handle
+
+
+class HandlePool(object):
+    """Pool of SDK file handles, to read one file from several threads.
+
+    The SDK functions release the GIL, but a single file handle cannot be
+    used by two threads at the same time. Each thread therefore borrows its
+    own handle from the pool. Handles are opened on demand, up to `size`.
+
+    Parameters
+    ----------
+    filename : str
+    size : int, optional
+        Maximum number of open handles. Defaults to 1.
+    handle : int, optional
+        An already opened handle, which is added to the pool.
+
+    After a fork, the child process does not use nor close the handles of
+    the parent, which share the file position with them. It opens its own.
+    """
+    def __init__(self, filename, size=1, handle=None):
+        if size < 1:
+            raise ValueError('The pool size should be at least 1.')
+        self.filename = filename
+        self.size = int(size)
+        self._opened = []
+        self._idle = queue.LifoQueue()
+        self._lock = Lock()
+        self._pid = os.getpid()
+        if handle is not None:
+            self._opened.append(handle)
+            self._idle.put(handle)
+
+    def __len__(self):
+        return len(self._opened)
+
+    @property
+    def closed(self):
+        return self._opened is None
+
+    def _check_fork(self):
+        """Forgets the handles of the parent process after a fork."""
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._lock = Lock()
+            self._idle = queue.LifoQueue()
+            if self._opened is not None:
+                self._opened = []
+
+    def _acquire(self):
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self.closed:
+                raise IOError('File is closed, unable to read data')
+            if len(self._opened) < self.size:
+                handle = open_handle(self.filename)
+                self._opened.append(handle)
+                return handle
+        return self._idle.get()
+
+    @contextmanager
+    def handle(self):
+        """Context manager that borrows a file handle from the pool."""
+        handle = self._acquire()
+        try:
+            yield handle
+        finally:
+            self._idle.put(handle)
+
+    def close(self):
+        """Closes all handles, after waiting for the ones in use."""
+        self._check_fork()
+        with self._lock:
+            opened, self._opened = self._opened, None
+        if opened is None:
+            return
+        for _ in opened:
+            h.Lim_FileClose(self._idle.get())
@@ -0,0 +1,79 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import io
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+INDEX_VERSION = 1
+INDEX_EXT = '.nd2idx'
+
+
+def default_index_dir():
+    """Returns the directory of index files: $PIMS_ND2_INDEX_DIR, or
+    pims_nd2 in the user cache directory."""
+    directory = os.environ.get('PIMS_ND2_INDEX_DIR')
+    if directory:
+        return directory
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'),
+                                             '.cache'))
+    return os.path.join(cache_home, 'pims_nd2')
+
+
+def index_path(filename, directory=None):
+    """Returns the path of the index file of `filename`."""
+    if directory is None:
+        directory = default_index_dir()
+    path = os.path.abspath(filename)
+    key = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    return os.path.join(directory, key + INDEX_EXT)
+
+
+def _file_key(filename):
+    stat = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def load_index(filename, directory=None):
+    """Loads the index of `filename`. Returns a dict with the header fields
+    and the arrays, or None when there is no index or when it is outdated
+    because the file changed."""
+    path = index_path(filename, directory)
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+            arrays = {k: data[k] for k in data.files if k != 'header'}
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    if (header.get('version') != INDEX_VERSION or
+            header.get('key') != _file_key(filename)):
+        return None
+    header.update(arrays)
+    return header
+
+
+def save_index(filename, header, arrays, directory=None):
+    """Stores the index of `filename`: a dict of json-serializable `header`
+    fields and a dict of numpy `arrays`. Failures are silently ignored, as
+    the index is only a cache."""
+    path = index_path(filename, directory)
+    header = dict(header, version=INDEX_VERSION, key=_file_key(filename))
+    buf = io.BytesIO()
+    np.savez(buf, header=np.array(json.dumps(header)), **arrays)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # write to a temporary file first, so that readers in other
+        # processes never see a partial index
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix=INDEX_EXT)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(buf.getvalue())
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except (IOError, OSError):
+        pass
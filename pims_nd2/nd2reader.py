@@ -4,9 +4,47 @@ from __future__ import (absolute_import, division, print_function,
 import numpy as np
 from pims.frame import Frame
 from pims.base_frames import FramesSequenceND
+from slicerator import Slicerator
 import os
+import weakref
+from ctypes import byref, c_double
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from . import ND2SDK as h
-from ctypes import c_uint8, c_uint16, c_float
+from .cache import PlaneCache
+from .handles import HandlePool, open_handle
+from .prefetch import Prefetcher
+from .rawmap import RawPictureMap
+from .projection import ND2_Projection
+from .index import load_index, save_index, _file_key
+from .stats import ReadStats, NULL_TIMER, _enable, _disable
+
+
+def _group_pictures(seq_indices):
+    """Groups the positions of `seq_indices` by SDK picture. Returns the
+    distinct sequence indices in sorted order, and for each of them the
+    positions where it occurs, in increasing order."""
+    unique, inverse = np.unique(np.ravel(seq_indices), return_inverse=True)
+    inverse = np.ravel(inverse)
+    order = np.argsort(inverse, kind='mergesort')
+    groups = np.split(order, np.cumsum(np.bincount(
+        inverse, minlength=len(unique)))[:-1])
+    return unique, groups
+
+
+class _FrameSlicerator(Slicerator):
+    """Slicerator over frames of an ND2_Reader. Iterating over repeated or
+    out-of-order frames reads their SDK pictures in sequence index order,
+    see `ND2_Reader._iter_frames`."""
+    def __iter__(self):
+        return self._ancestor._iter_frames(self.indices)
+
+    def __getitem__(self, key):
+        result = super(_FrameSlicerator, self).__getitem__(key)
+        if type(result) is Slicerator:
+            result = _FrameSlicerator(self._ancestor, result._indices,
+                                      len(result), self._propagate_attrs)
+        return result
 
 
 class ND2_Reader(FramesSequenceND):
@@ -20,6 +58,11 @@ class ND2_Reader(FramesSequenceND):
 
     It is recommended to work with a context manager (see Examples)
 
+    Readers can be pickled, e.g. to pass them to a process pool. Only the
+    file name, the options, the axes and the file description that was
+    already read are pickled, and the SDK opens the file again on the first
+    read. After a fork, the child process opens its own SDK handles.
+
     Parameters
     ----------
     filename: str
@@ -28,6 +71,51 @@ class ND2_Reader(FramesSequenceND):
         property.
     channel: int, optional
         Default channel
+    roi: tuple of int, optional
+        Region of interest (y0, y1, x0, x1). Only this rectangle is read from
+        each picture. Changeable via the `roi` property.
+    scale: float, optional
+        Downsampling factor between 0 and 1. Pictures are resized by the SDK
+        while reading, which is much cheaper than reading full pictures.
+        Changeable via the `scale` property. Defaults to 1.
+    stretch: {'quick', 'linear', 'splines'}, optional
+        Resampling method of the SDK when `scale` is not 1. Defaults to
+        'quick' (nearest neighbour).
+    cache_size: int, optional
+        Memory budget in bytes for caching decoded pictures. Revisited frames
+        are then not decoded again. Defaults to 0 (no caching).
+    handles: int, optional
+        Maximum number of SDK file handles. With more than one handle, several
+        threads can decode pictures at the same time. Defaults to 1.
+    prefetch: int, optional
+        Number of frames to decode ahead of sequential reading, on a
+        background thread with its own SDK handle. Defaults to 0 (off).
+    index_cache: bool or str, optional
+        Store the file attributes, metadata, sequence index tables and
+        per-picture timestamps in an index file, so that reopening the file
+        does not query the SDK until pixels are read. Opening only stores
+        the attributes; the other parts are added when they are first read.
+        True uses the user cache directory (or $PIMS_ND2_INDEX_DIR), a
+        string gives the directory. The index is renewed when the file
+        changes. Defaults to False.
+    tile_shape: tuple of int, optional
+        Tile shape (height, width) for `read_window`. Defaults to the tile
+        shape of the file, or the whole picture for files that are not
+        tiled.
+    tile_cache_size: int, optional
+        Memory budget in bytes for caching tiles read by `read_window`.
+        With a budget, windows are read as whole tiles, so that overlapping
+        windows do not read the same pixels again. Defaults to 0 (windows are
+        read exactly, without caching).
+    memmap: bool or 'view', optional
+        Read the pixels and times of uncompressed files directly through a
+        memory map of the file, without decoding by the SDK, when the scale
+        is 1. The cache and prefetching are then not used, and several
+        processes share the same memory. The map is made on the first read
+        of pixels. The stage positions are not in the map: unless
+        `frame_table` was read, the SDK reads them with one pixel, once per
+        picture. With 'view', frames are read-only views on the file instead
+        of copies. Defaults to True.
 
     Attributes
     ----------
@@ -62,11 +150,63 @@ class ND2_Reader(FramesSequenceND):
         The pixel size in microns per pixel, in x, y direction
     calibrationZ : float
         The pixel size in microns per pixel, in z direction
+    roi : tuple of int or None
+        Region of interest (y0, y1, x0, x1) in pixels. Frames and the x and y
+        axis sizes are cropped to this rectangle. None reads whole pictures.
+        The region is given in pixels of the full resolution pictures.
+    scale : float
+        Downsampling factor of frames. The x and y axis sizes follow it.
+    seq_index_table : ndarray of int
+        Sequence index of the SDK picture at each (t, m, z, o) coordinate.
+        Axes that are not present have size 1.
+    coords_table : ndarray of int
+        The (t, m, z, o) coordinates of each sequence index.
+    frame_table : structured ndarray
+        Coordinates, time (t_ms) and stage position (x_um, y_um, z_um) of
+        each sequence index. Built once, without decoding full pictures.
+    cache : PlaneCache or None
+        Cache of decoded pictures, keyed by sequence index. Reports `hits`,
+        `misses` and `nbytes`.
+    tile_shape : tuple of int
+        Tile shape (height, width) of `read_window`.
+    tile_cache : PlaneCache or None
+        Cache of tiles, keyed by sequence index and tile row and column.
+    stats : ReadStats or None
+        Call counts, latencies and bytes of SDK functions and reader stages,
+        when enabled with `enable_stats`. None by default.
+    memmap : bool
+        Whether pictures are read through a memory map of the file.
 
     Methods
     ----------
     close() :
         Closes the reader, necessary if context manager is not used.
+    get_seq_index(**coords) :
+        Returns the sequence index of the SDK picture at given coordinates.
+    read_into(out, **coords) :
+        Reads one frame into a preallocated array.
+    read_frames_into(out, seq_indices) :
+        Reads SDK pictures into a preallocated array, without extra copies.
+    get_frames(seq_indices, workers=None) :
+        Decodes SDK pictures in parallel threads.
+    read_window(y0, y1, x0, x1, **coords) :
+        Reads a window of a (large) picture, tile by tile.
+    read_block(**coords) :
+        Reads a block of pictures, e.g. a hyperstack, into one array.
+    get_volume(t=None, m=None) :
+        Reads a z stack with all channels into one array.
+    project(axis='z', op='max') :
+        Returns a lazy projection, e.g. a maximum intensity projection.
+    read_boxes(boxes) :
+        Crops a table of boxes out of the pictures into one array.
+    to_dask(chunks=None) :
+        Returns a lazy dask array over all axes.
+    aget_frame(i), aget_frame_2D(**coords), aiter_frames() :
+        asyncio versions of get_frame, get_frame_2D and iteration.
+    clear_cache() :
+        Empties the cache of decoded pictures.
+    enable_stats(hook=None) :
+        Starts recording SDK call and reader stage statistics.
 
     Examples
     ----------
@@ -79,17 +219,80 @@ class ND2_Reader(FramesSequenceND):
 
     class_priority = 20
 
-    def __init__(self, filename, series=0, channel=0):
+    # maximum number of bytes of SDK pictures decoded ahead, in sequence
+    # index order, when iterating over a slice or a list of frames
+    _batch_bytes = 128 * 2**20
+
+    def __init__(self, filename, series=0, channel=0, roi=None, scale=1.,
+                 stretch='quick', cache_size=0, handles=1, prefetch=0,
+                 index_cache=False, tile_shape=None, tile_cache_size=0,
+                 memmap=True):
+        super(ND2_Reader, self).__init__()
+        self._open(filename, None, series=series, channel=channel, roi=roi,
+                   scale=scale, stretch=stretch, cache_size=cache_size,
+                   handles=handles, prefetch=prefetch,
+                   index_cache=index_cache, tile_shape=tile_shape,
+                   tile_cache_size=tile_cache_size, memmap=memmap)
+
+    def _open(self, filename, index, series, channel, roi, scale, stretch,
+              cache_size, handles, prefetch, index_cache, tile_shape,
+              tile_cache_size, memmap):
+        """Opens the file. The file description is taken from `index` when
+        given, e.g. when unpickling, so that the SDK is not queried."""
+        self._options = {'series': series, 'channel': channel,
+                         'stretch': stretch, 'cache_size': cache_size,
+                         'handles': handles, 'prefetch': prefetch,
+                         'index_cache': index_cache, 'tile_shape': tile_shape,
+                         'tile_cache_size': tile_cache_size,
+                         'memmap': memmap}
+        self._pid = os.getpid()
+        self.cache = PlaneCache(cache_size) if cache_size else None
+        self.tile_cache = (PlaneCache(tile_cache_size) if tile_cache_size
+                           else None)
+        self._prefetcher = None
+        self._pool = None
+        self._raw = None
+        self._raw_pending = False  # whether to make the map on first read
+        self._raw_lock = Lock()
+        self._pinned = dict()  # pictures of each iterator, see _iter_frames
+        self._dask_sources = set()
+        self.stats = None
+        self._executor = None
+        self._executor_lock = Lock()
+        self._async_limits = weakref.WeakKeyDictionary()
         if not os.path.isfile(filename):
             raise IOError('The file "{}" does not exist.'.format(filename))
         self.filename = str(filename)
+        index_dir = None if index_cache is True else index_cache
         try:
-            handle = h.Lim_FileOpenForRead(os.path.abspath(self.filename))
-            self._handle = handle
+            if index is None and index_cache:
+                index = load_index(self.filename, index_dir)
+            if index is None:
+                handle = open_handle(self.filename)
+                self._pool = HandlePool(self.filename, handles, handle)
+                attr, dims = self._query_sdk(handle)
+            else:
+                # the file is only opened when pixels are needed
+                self._pool = HandlePool(self.filename, handles)
+                attr = h.struct_from_dict(h.LIMATTRIBUTES(),
+                                          index['attributes'])
+                dims = h.struct_from_dict(h.LIMEXPERIMENT(),
+                                          index['experiment'])
+
+            # the metadata description and z stack home are only queried
+            # when needed
+            self._index_metadata_desc = (None if index is None
+                                         else index.get('metadata_desc'))
+            self._metadata_desc = None
+            self._calibration = None
+            self._colors = None
+            self._z_home_queried = index is not None and 'z_home' in index
+            self._z_home_value = (None if index is None
+                                  else index.get('z_home'))
+            self._large_image = (None if index is None
+                                 else index.get('large_image'))
 
             # obtain image attributes
-            attr = h.LIMATTRIBUTES()
-            h.Lim_FileGetAttributes(handle, attr)
             self._init_axis('x', attr.uiWidth)
             self._init_axis('y', attr.uiHeight)
             if attr.uiComp > 1:
@@ -102,16 +305,10 @@ class ND2_Reader(FramesSequenceND):
             self._pixel_type = {8: np.uint8,
                                 16: np.uint16,
                                 32: np.float32}[self._pixel_size]
-            self._pixel_type_C = {8: c_uint8,
-                                  16: c_uint16,
-                                  32: c_float}[self._pixel_size]
             self.max_value = 2**attr.uiBpcSignificant - 1
             self._lim_attributes = attr
 
             # obtain extra dimension sizes
-            dims = h.LIMEXPERIMENT()
-            h.Lim_FileGetExperiment(handle, dims)
-            self._z_home = None
             for i in range(dims.uiLevelCount):
                 dim = dims.pAllocatedLevels[i]
                 dimtype = h.LIMLOOP[dim.uiExpType]
@@ -127,36 +324,39 @@ class ND2_Reader(FramesSequenceND):
                 elif dimtype == 'LIMLOOP_Z':
                     self._init_axis('z', dim.uiLoopSize)
                     self.calibrationZ = dim.dInterval
-                    self._z_home = h.Lim_GetZStackHome(self._handle)
                 elif dimtype == 'LIMLOOP_OTHER':
                     self._init_axis('o', dim.uiLoopSize)
             self._lim_experiment = dims
+            self._seq_index_table = None
+            self._coords_table = None
+            self._frame_table = None
 
             self._frame_rate = None
 
-            # get metadata
-            bufmd = h.LIMMETADATA_DESC()
-            h.Lim_FileGetMetadata(self._handle, bufmd)
-            if bufmd.dAspect != 1.:
-                raise RuntimeError('Non-square pixels are not supported.')
-            self._lim_metadata_desc = bufmd
-            self.calibration = bufmd.dCalibration
-            self.colors = [None] * bufmd.uiPlaneCount
-            for i in range(len(self.colors)):
-                plane = bufmd.pPlanes[i]
-                self.colors[i] = h.rgb_int_to_float_tuple(plane.uiColorRGB)
-
-            # initialize read buffers
-            self._buf_p = h.LIMPICTURE()
-            self._buf_p_size = h.Lim_InitPicture(self._buf_p,
-                                                 attr.uiWidth,
-                                                 attr.uiHeight,
-                                                 self._pixel_size,
-                                                 attr.uiComp)
-            arr_size = attr.uiWidth * attr.uiHeight * attr.uiComp
-            arr = self._pixel_type_C * arr_size
-            self._buf_p_a = arr.from_address(self._buf_p.pImageData)
-            self._buf_md = h.LIMLOCALMETADATA()
+            self._register_get_frame(self.get_frame_2D, 'yx')
+            if 'c' in self.axes:
+                # one SDK picture holds all channels: decode it once
+                self._register_get_frame(self.get_frame_cyx, 'cyx')
+
+            if tile_shape is None:
+                tile_shape = (attr.uiTileHeight or attr.uiHeight,
+                              attr.uiTileWidth or attr.uiWidth)
+            self.tile_shape = tuple(int(v) for v in tile_shape)
+            if min(self.tile_shape) < 1:
+                raise ValueError('The tile shape should be positive.')
+
+            self._stretch = stretch
+            self._stretch_mode = h.STRETCH_MODES[stretch]
+            self._set_rect(roi, scale)
+
+            self._raw_pending = bool(memmap) and h.compression_type.get(
+                attr.uiCompression, 'unknown') is None
+
+            self.prefetch = int(prefetch)
+            if self.prefetch > 0:
+                self._prefetcher = Prefetcher(self._decode_new,
+                                              self._open_handle,
+                                              h.Lim_FileClose)
 
             if 'z' in self.axes:
                 self.bundle_axes = 'zyx'
@@ -165,50 +365,1074 @@ class ND2_Reader(FramesSequenceND):
             if 'c' in self.axes:
                 self.default_coords['c'] = channel
 
+            if index is not None:
+                self._seq_index_table = index.get('seq_index_table')
+                self._coords_table = index.get('coords_table')
+                self._frame_table = index.get('frame_table')
+            elif index_cache:
+                self._update_index()
+
         except Exception as e:
-            h.Lim_FileClose(self._handle)
-            self._handle = None
+            self.close()
             raise e
 
+    def _query_sdk(self, handle):
+        """Returns the attributes and experiment of the file, which is all
+        that is needed for the axes and their sizes."""
+        attr = h.LIMATTRIBUTES()
+        h.Lim_FileGetAttributes(handle, attr)
+        dims = h.LIMEXPERIMENT()
+        h.Lim_FileGetExperiment(handle, dims)
+        return attr, dims
+
+    @property
+    def _lim_metadata_desc(self):
+        """The metadata description (LIMMETADATA_DESC) of the file, which
+        holds the calibration and the channel descriptions. It is large, so
+        it is only read when needed."""
+        if self._metadata_desc is None:
+            if self._index_metadata_desc is not None:
+                bufmd = h.struct_from_dict(h.LIMMETADATA_DESC(),
+                                           self._index_metadata_desc)
+            else:
+                bufmd = h.LIMMETADATA_DESC()
+                with self._pool.handle() as handle:
+                    h.Lim_FileGetMetadata(handle, bufmd)
+            if bufmd.dAspect != 1.:
+                raise RuntimeError('Non-square pixels are not supported.')
+            self._metadata_desc = bufmd
+            if self._index_metadata_desc is None:
+                self._update_index()
+        return self._metadata_desc
+
+    @property
+    def _z_home(self):
+        if not self._z_home_queried:
+            if 'z' in self.axes:
+                with self._pool.handle() as handle:
+                    self._z_home_value = h.Lim_GetZStackHome(handle)
+            self._z_home_queried = True
+            self._update_index()
+        return self._z_home_value
+
+    @property
+    def calibration(self):
+        if self._calibration is None:
+            self._calibration = self._lim_metadata_desc.dCalibration
+        return self._calibration
+
+    @calibration.setter
+    def calibration(self, value):
+        self._calibration = value
+
+    @property
+    def colors(self):
+        if self._colors is None:
+            bufmd = self._lim_metadata_desc
+            self._colors = [h.rgb_int_to_float_tuple(plane.uiColorRGB)
+                            for plane in bufmd.pPlanes[:bufmd.uiPlaneCount]]
+        return self._colors
+
+    @colors.setter
+    def colors(self, value):
+        self._colors = value
+
+    def _index_data(self, complete=True):
+        """Returns the file description and tables as a dict of header
+        fields and a dict of arrays. Unless `complete`, only the parts that
+        were already read from the file are included."""
+        experiment = h.struct_to_dict(self._lim_experiment)
+        levels = experiment['pAllocatedLevels']
+        experiment['pAllocatedLevels'] = levels[:experiment['uiLevelCount']]
+        header = {'attributes': h.struct_to_dict(self._lim_attributes),
+                  'experiment': experiment}
+        arrays = dict()
+        if complete or self._coords_table is not None:
+            arrays['seq_index_table'] = self.seq_index_table
+            arrays['coords_table'] = self.coords_table
+        if complete or self._metadata_desc is not None:
+            metadata_desc = h.struct_to_dict(self._lim_metadata_desc)
+            planes = metadata_desc['pPlanes']
+            metadata_desc['pPlanes'] = planes[:metadata_desc['uiPlaneCount']]
+            header['metadata_desc'] = metadata_desc
+        elif self._index_metadata_desc is not None:
+            header['metadata_desc'] = self._index_metadata_desc
+        if complete or self._z_home_queried:
+            header['z_home'] = self._z_home
+        if complete or self._large_image is not None:
+            header['large_image'] = self._large_image_dimensions()
+        if complete or self._frame_table is not None:
+            arrays['frame_table'] = self.frame_table
+        return header, arrays
+
+    def _update_index(self):
+        """Stores the parts of the file description and the tables that were
+        read in the index file, with `index_cache`. Called when a part is
+        read, so that the index grows with what is used of the file."""
+        index_cache = self._options['index_cache']
+        if not index_cache:
+            return
+        header, arrays = self._index_data(complete=False)
+        save_index(self.filename, header, arrays,
+                   None if index_cache is True else index_cache)
+
+    def __getstate__(self):
+        """Pickles the file name, the options and axes of the reader and
+        the part of the file description that was read. Open handles,
+        caches and threads are not pickled."""
+        header, arrays = self._index_data(complete=False)
+        header.update(arrays)
+        filename = os.path.abspath(self.filename)
+        header['key'] = _file_key(filename)
+        return {'filename': filename,
+                'options': dict(self._options, roi=self._roi,
+                                scale=self._scale),
+                'index': header,
+                'calibration': self._calibration,
+                'colors': self._colors,
+                'iter_axes': list(self.iter_axes),
+                'bundle_axes': list(self.bundle_axes),
+                'default_coords': dict(self.default_coords)}
+
+    def __setstate__(self, state):
+        """Reopens the reader from its pickled state. The file description
+        is taken from the state, unless the file changed, and the SDK opens
+        the file only when pixels are read."""
+        index = state['index']
+        if (not os.path.isfile(state['filename']) or
+                index['key'] != _file_key(state['filename'])):
+            index = None
+        self._restore(state, index)
+
+    def _restore(self, state, index):
+        FramesSequenceND.__init__(self)
+        self._open(state['filename'], index, **state['options'])
+        self._calibration = state['calibration']
+        self._colors = state['colors']
+        self.default_coords.update(state['default_coords'])
+        self.bundle_axes = state['bundle_axes']
+        self.iter_axes = state['iter_axes']
+
+    def _check_fork(self):
+        """Drops the prefetch thread and the executor after a fork: threads
+        do not survive in the child process. The pool of SDK handles checks
+        for forks itself."""
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+        self._pid = pid
+        self._executor = None
+        self._executor_lock = Lock()
+        self._async_limits = weakref.WeakKeyDictionary()
+        if self._prefetcher is not None:
+            # the handle of the thread belongs to the parent process
+            self._prefetcher = Prefetcher(self._decode_new,
+                                          self._open_handle,
+                                          h.Lim_FileClose)
+
+    def _open_handle(self):
+        return open_handle(self.filename)
+
+    def clear_cache(self):
+        """Empties the cache of decoded pictures and tiles."""
+        if self.cache is not None:
+            self.cache.clear()
+        if self.tile_cache is not None:
+            self.tile_cache.clear()
+
+    def enable_stats(self, hook=None):
+        """Starts recording the call counts, latencies and bytes of the SDK
+        functions and of the reader stages, and returns the ReadStats (see
+        `stats`). `hook(name, seconds, nbytes)` is called after each recorded
+        call, e.g. to export to a metrics system. Nothing is recorded until
+        stats are enabled, which keeps the overhead near zero.
+
+        SDK calls are attributed to the reader whose stage makes them. Use
+        `pims_nd2.record_stats` to enable statistics for a block only."""
+        if self.stats is None:
+            _enable()
+            self.stats = ReadStats(hook)
+        elif hook is not None:
+            self.stats.hook = hook
+        return self.stats
+
+    def disable_stats(self):
+        """Stops recording statistics, and returns the recorded ReadStats."""
+        stats, self.stats = self.stats, None
+        if stats is not None:
+            _disable()
+        return stats
+
+    def _timer(self, name, nbytes=0):
+        """Returns a context manager that records the stage `name`, when
+        statistics are enabled."""
+        stats = self.stats
+        return NULL_TIMER if stats is None else stats.timer(name, nbytes)
+
     def close(self):
-        if self._handle:
-            h.Lim_DestroyPicture(self._buf_p)
-            h.Lim_FileClose(self._handle)
-            self._handle = None
+        self._check_fork()
+        if self._pool is not None and not self._pool.closed:
+            # the calibration and colors stay readable after closing
+            try:
+                self._lim_metadata_desc
+                self._z_home
+            except Exception:  # e.g. closing after a failed open
+                pass
+        self.disable_stats()
+        self.clear_cache()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+        self._raw_pending = False
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+        if self._pool is not None:
+            self._pool.close()
+        if self._dask_sources:
+            from .dask_array import close_readers
+            close_readers(self._dask_sources)
+            self._dask_sources = set()
 
     def __del__(self):
         self.close()
 
-    def get_frame_2D(self, **coords):
-        if self._handle is None:
-            raise IOError('File is closed, unable to read data')
+    def _build_seq_index_tables(self):
+        """Maps all sequence indices to coordinates and back, once."""
+        n = self._lim_attributes.uiSequenceCount
+        coords = np.empty((n, 4), dtype=np.intp)
+        buf = h.LIMUINT_4()
+        buf_a = np.ctypeslib.as_array(buf)
+        for i in range(n):
+            h.Lim_GetCoordsFromSeqIndex(self._lim_experiment, i, buf)
+            coords[i] = buf_a
+
+        shape = tuple(self.sizes.get(k, 1) for k in 'tmzo')
+        table = np.full(shape, -1, dtype=np.intp)
+        valid = np.all(coords < shape, axis=1)
+        table[tuple(coords[valid].T)] = np.arange(n)[valid]
+        # ask the SDK for the coordinates that no sequence index maps to
+        for index in zip(*np.nonzero(table < 0)):
+            table[index] = h.Lim_GetSeqIndexFromCoords(
+                self._lim_experiment, h.LIMUINT_4(*[int(v) for v in index]))
+        self._coords_table = coords
+        self._seq_index_table = table
+        self._update_index()
+
+    @property
+    def seq_index_table(self):
+        if self._seq_index_table is None:
+            self._build_seq_index_tables()
+        return self._seq_index_table
+
+    @property
+    def coords_table(self):
+        if self._coords_table is None:
+            self._build_seq_index_tables()
+        return self._coords_table
+
+    def get_seq_index(self, **coords):
+        """Returns the sequence index of the SDK picture at `coords`. One SDK
+        picture contains all channels. Coordinates may be arrays, to look up
+        many sequence indices at once."""
+        result = self.seq_index_table[tuple(coords.get(k, 0)
+                                            for k in 'tmzo')]
+        if np.ndim(result) == 0:
+            return int(result)
+        return result
+
+    def _decode(self, i, out, handle=None):
+        """Lets the SDK write picture `i` directly into `out`, which has the
+        (y, x[, c]) layout of one SDK picture with contiguous rows. Only the
+        region of interest is read, at the current scale. Returns the stage
+        position and time of the picture.
+
+        A handle is borrowed from the pool, unless `handle` is given."""
+        if self.memmap:
+            im, local_md = self._map_picture(i)
+            with self._timer('copy', out.nbytes):
+                np.copyto(out, im)
+            return local_md
+        if handle is None:
+            with self._pool.handle() as handle:
+                return self._decode(i, out, handle)
+        if not 0 <= i < self._lim_attributes.uiSequenceCount:
+            raise IndexError('Sequence index {} out of range'.format(i))
+        total_h, total_w, y0, y1, x0, x1 = self._rect
+        buf_md = h.LIMLOCALMETADATA()
+        with self._timer('decode', out.nbytes):
+            h.Lim_FileGetImageRectData(handle, i, total_w, total_h,
+                                       x0, y0, x1 - x0, y1 - y0,
+                                       out.ctypes.data, out.strides[0],
+                                       self._stretch_mode, buf_md)
+        return {'x_um': buf_md.dXPos,
+                'y_um': buf_md.dYPos,
+                'z_um': buf_md.dZPos,
+                't_ms': buf_md.dTimeMSec}
+
+    def _read_rect(self, i, y0, y1, x0, x1, out):
+        """Reads the rectangle (y0, y1, x0, x1) of picture `i` at full
+        resolution into `out`, which has the (y, x[, c]) layout of an SDK
+        picture with contiguous rows. The region of interest and scale of
+        the reader do not apply."""
+        if not 0 <= i < self._lim_attributes.uiSequenceCount:
+            raise IndexError('Sequence index {} out of range'.format(i))
+        if self._picture_map is not None:
+            np.copyto(out, self._raw.picture(i)[y0:y1, x0:x1])
+            return
+        attr = self._lim_attributes
+        buf_md = h.LIMLOCALMETADATA()
+        with self._pool.handle() as handle:
+            with self._timer('decode', out.nbytes):
+                h.Lim_FileGetImageRectData(handle, i, attr.uiWidth,
+                                           attr.uiHeight, x0, y0, x1 - x0,
+                                           y1 - y0, out.ctypes.data,
+                                           out.strides[0],
+                                           h.LIMSTRETCH_QUICK, buf_md)
+
+    def _read_tile(self, i, ty, tx):
+        """Returns tile (ty, tx) of picture `i`, from the tile cache if
+        possible. Tiles at the right and bottom edges may be smaller."""
+        key = (i, ty, tx)
+        cached = self.tile_cache.get(key)
+        if cached is not None:
+            return cached[0]
+        attr = self._lim_attributes
+        th, tw = self.tile_shape
+        y0, x0 = ty * th, tx * tw
+        y1, x1 = min(y0 + th, attr.uiHeight), min(x0 + tw, attr.uiWidth)
+        tile = np.empty((y1 - y0, x1 - x0) + self._lim_frame_shape[2:],
+                        self.pixel_type)
+        self._read_rect(i, y0, y1, x0, x1, tile)
+        self.tile_cache.put(key, tile)
+        return tile
 
-        _coords = {'t': 0, 'c': 0, 'z': 0, 'o': 0, 'm': 0}
+    def read_window(self, y0, y1, x0, x1, **coords):
+        """Reads the window (y0, y1, x0, x1) of the picture at `coords`, in
+        full resolution pixels, without reading the rest of the picture.
+        This gives fast access to parts of large (stitched) pictures.
+
+        Coordinates that are not given are taken from `default_coords`. The
+        result has shape (y, x) for channel `c`, or (c, y, x) when `c` is
+        None. The region of interest and scale of the reader do not apply.
+
+        With a tile cache (see `tile_cache_size`), the window is read tile
+        by tile and tiles are cached, which makes panning over a large
+        picture cheap. Without, exactly the window is read."""
+        if self._pool.closed:
+            raise IOError('File is closed, unable to read data')
+        attr = self._lim_attributes
+        y0, y1, x0, x1 = int(y0), int(y1), int(x0), int(x1)
+        if not (0 <= y0 < y1 <= attr.uiHeight and
+                0 <= x0 < x1 <= attr.uiWidth):
+            raise ValueError('The window {} does not fit in pictures of shape '
+                             '{}'.format((y0, y1, x0, x1),
+                                         (attr.uiHeight, attr.uiWidth)))
+        _coords = dict(self.default_coords)
         _coords.update(coords)
-        i = h.Lim_GetSeqIndexFromCoords(self._lim_experiment,
-                                        h.LIMUINT_4(int(_coords['t']),
-                                                    int(_coords['m']),
-                                                    int(_coords['z']),
-                                                    int(_coords['o'])))
-
-        h.Lim_FileGetImageData(self._handle, i, self._buf_p, self._buf_md)
-        im = np.ndarray(self._lim_frame_shape, self.pixel_type,
-                        self._buf_p_a).copy()
-
-        if im.ndim == 3:
-            im = im[:, :, _coords['c']]
-
-        metadata = {'x_um': self._buf_md.dXPos,
-                    'y_um': self._buf_md.dYPos,
-                    'z_um': self._buf_md.dZPos,
-                    't_ms': self._buf_md.dTimeMSec,
-                    'colors': self.colors,
-                    'mpp': self.calibration,
+        i = self.get_seq_index(**_coords)
+
+        out = np.empty((y1 - y0, x1 - x0) + self._lim_frame_shape[2:],
+                       self.pixel_type)
+        if self.tile_cache is None:
+            self._read_rect(i, y0, y1, x0, x1, out)
+        else:
+            th, tw = self.tile_shape
+            for ty in range(y0 // th, (y1 - 1) // th + 1):
+                for tx in range(x0 // tw, (x1 - 1) // tw + 1):
+                    tile = self._read_tile(i, ty, tx)
+                    # the part of the tile that is in the window
+                    ya, yb = max(y0, ty * th), min(y1, (ty + 1) * th)
+                    xa, xb = max(x0, tx * tw), min(x1, (tx + 1) * tw)
+                    out[ya - y0:yb - y0, xa - x0:xb - x0] = \
+                        tile[ya - ty * th:yb - ty * th,
+                             xa - tx * tw:xb - tx * tw]
+
+        if out.ndim == 3:
+            if _coords.get('c') is None:
+                out = np.rollaxis(out, 2).copy()
+            else:
+                out = out[:, :, _coords['c']].copy()
+        metadata = {'window': (y0, y1, x0, x1),
+                    'mpp': self.calibration}
+        metadata.update(_coords)
+        return Frame(out, metadata=metadata)
+
+    def _local_metadata(self, i, handle):
+        """Returns the stage position and time of picture `i`. The SDK only
+        provides these with pixel data, so a single pixel is read."""
+        buf = np.empty(self._lim_frame_shape[2:], self.pixel_type)
+        buf_md = h.LIMLOCALMETADATA()
+        h.Lim_FileGetImageRectData(handle, i, 1, 1, 0, 0, 1, 1,
+                                   buf.ctypes.data, buf.nbytes,
+                                   h.LIMSTRETCH_QUICK, buf_md)
+        return buf_md.dTimeMSec, buf_md.dXPos, buf_md.dYPos, buf_md.dZPos
+
+    @property
+    def _picture_map(self):
+        """The memory map of the pictures (RawPictureMap), made on the first
+        read of pixels, or None when pictures are read through the SDK."""
+        if self._raw_pending:
+            with self._raw_lock:
+                if self._raw_pending:
+                    attr = self._lim_attributes
+                    try:
+                        self._raw = RawPictureMap(
+                            self.filename, attr.uiSequenceCount,
+                            (attr.uiHeight, attr.uiWidth) +
+                            self._lim_frame_shape[2:],
+                            self._pixel_type, attr.uiWidthBytes)
+                    except (IOError, ValueError):
+                        pass  # unknown file layout: read through the SDK
+                    else:
+                        # stage positions of the pictures read so far
+                        n = attr.uiSequenceCount
+                        self._positions = np.empty((n, 3), np.float64)
+                        self._positions_read = np.zeros(n, bool)
+                    self._raw_pending = False
+        return self._raw
+
+    @property
+    def memmap(self):
+        return self._scale == 1 and self._picture_map is not None
+
+    @property
+    def _shared_pictures(self):
+        """Whether pictures are read-only views on shared memory, which are
+        returned in frames without copying."""
+        return self._options['memmap'] == 'view' and self.memmap
+
+    def _map_picture(self, i):
+        """Returns a read-only view of the region of interest of picture `i`
+        on the memory map of the file, and its stage position and time. The
+        time is stored with the picture. The positions are looked up in
+        `frame_table` if it was read, and otherwise read through the SDK
+        once per picture."""
+        if not 0 <= i < self._lim_attributes.uiSequenceCount:
+            raise IndexError('Sequence index {} out of range'.format(i))
+        _, _, y0, y1, x0, x1 = self._rect
+        frame_table = self._frame_table
+        if frame_table is not None:
+            row = frame_table[i]
+            x, y, z = row['x_um'], row['y_um'], row['z_um']
+        elif self._positions_read[i]:
+            x, y, z = self._positions[i]
+        else:
+            with self._pool.handle() as handle:
+                _, x, y, z = self._local_metadata(i, handle)
+            self._positions[i] = x, y, z
+            self._positions_read[i] = True
+        return (self._raw.picture(i)[y0:y1, x0:x1],
+                {'x_um': float(x),
+                 'y_um': float(y),
+                 'z_um': float(z),
+                 't_ms': self._raw.timestamp(i)})
+
+    def _read_seq_index(self, i):
+        """Returns picture `i` with shape (y, x) or (y, x, c) and its stage
+        position and time. Pictures from the cache or the memory map are
+        read-only."""
+        pinned = self._get_pinned(i)
+        if pinned is not None:
+            return pinned
+        self._check_fork()
+        with self._timer('read_picture'):
+            if self.memmap:
+                # the page cache of the system is the cache
+                return self._map_picture(i)
+            if self.cache is not None:
+                cached = self.cache.get(i)
+                if cached is not None:
+                    return cached
+
+            prefetched = None
+            if self._prefetcher is not None:
+                prefetched = self._prefetcher.take(i)
+            if prefetched is None:
+                im, local_md = self._decode_new(i)
+            else:
+                im, local_md = prefetched
+
+            if self.cache is not None:
+                self.cache.put(i, im, local_md)
+            return im, local_md
+
+    def _decode_new(self, i, handle=None):
+        """Decodes picture `i` into a new array."""
+        im = np.empty(self._lim_frame_shape, self.pixel_type)
+        return im, self._decode(i, im, handle)
+
+    def _read_seq_index_into(self, i, out):
+        """Reads picture `i` into `out`, from the cache if possible. Returns
+        the stage position and time of the picture."""
+        cached = None if self.cache is None else self.cache.get(i)
+        if cached is None:
+            return self._decode(i, out)
+        np.copyto(out, cached[0])
+        return cached[1]
+
+    def _frame_seq_indices(self, i):
+        """Returns the sequence indices of the pictures in frame `i`."""
+        coords = dict(self.default_coords)
+        iter_sizes = [self.sizes[k] for k in self.iter_axes]
+        coords.update(zip(self.iter_axes, np.unravel_index(i, iter_sizes)))
+        bundled = [k for k in self.bundle_axes if k in 'tmzo']
+        coords.update(zip(bundled, np.ix_(*[np.arange(self.sizes[k])
+                                            for k in bundled])))
+        return np.ravel(self.get_seq_index(**coords)).tolist()
+
+    def get_frame(self, i):
+        self._check_fork()
+        if self._prefetcher is not None and not self.memmap:
+            current = self._frame_seq_indices(i)
+            wanted = []
+            for j in range(i + 1, min(i + 1 + self.prefetch, len(self))):
+                wanted.extend(self._frame_seq_indices(j))
+            self._prefetcher.schedule(wanted, keep=current)
+        with self._timer('get_frame'):
+            return super(ND2_Reader, self).get_frame(i)
+
+    def __getitem__(self, key):
+        result = super(ND2_Reader, self).__getitem__(key)
+        if type(result) is Slicerator:
+            result = _FrameSlicerator(self, result._indices, len(result),
+                                      result._propagate_attrs)
+        return result
+
+    def _get_pinned(self, i):
+        """Returns picture `i` and its metadata if an iterator pinned it,
+        or None."""
+        for pins in list(self._pinned.values()):
+            pinned = pins.get(i)
+            if pinned is not None:
+                return pinned
+        return None
+
+    def _frame_batches(self, indices):
+        """Yields the frames `indices` in batches, with the sorted sequence
+        indices of the pictures of each batch. A batch has at most
+        `_batch_bytes` of pictures, and at most `prefetch` frames when
+        pictures are prefetched, but at least one frame."""
+        indices = iter(indices)
+        while True:
+            picture_bytes = (int(np.prod(self._lim_frame_shape)) *
+                             np.dtype(self.pixel_type).itemsize)
+            max_pictures = max(self._batch_bytes // picture_bytes, 1)
+            max_frames = None
+            if self._prefetcher is not None and not self.memmap:
+                max_frames = max(self.prefetch, 1)
+            batch = []
+            seq_indices = set()
+            for i in indices:
+                batch.append(i)
+                seq_indices.update(self._frame_seq_indices(i))
+                if (len(seq_indices) >= max_pictures or
+                        len(batch) == max_frames):
+                    break
+            if not batch:
+                return
+            yield batch, sorted(seq_indices)
+
+    def _iter_frames(self, indices):
+        """Yields the frames `indices`, in the given order.
+
+        Frames in increasing order, such as all frames, are read one by one
+        with `get_frame`, which prefetches `prefetch` frames ahead.
+
+        Repeated and out-of-order frames are taken in batches. The distinct
+        SDK pictures of a batch are decoded once, in sequence index order,
+        which is the order in the file, so that they do not cause extra
+        decoding or seeking. With `prefetch`, a batch has at most `prefetch`
+        frames, and the pictures of the next batch are decoded in the
+        background while the frames of a batch are used.
+
+        The pictures of a batch are pinned for this iterator only, so that
+        iterators over the same reader do not interfere."""
+        indices = [int(i) for i in indices]
+        if all(a < b for a, b in zip(indices, indices[1:])):
+            for i in indices:
+                yield self.get_frame(i)
+            return
+        batches = self._frame_batches(indices)
+        batch = next(batches, None)
+        token = object()
+        pins = self._pinned[token] = dict()
+        try:
+            while batch is not None:
+                frames, seq_indices = batch
+                batch = next(batches, None)
+                if self._prefetcher is not None and not self.memmap:
+                    # pictures of this batch are pinned, not prefetched again
+                    current = set(seq_indices)
+                    wanted = [] if batch is None else [
+                        i for i in batch[1] if i not in current]
+                    self._prefetcher.schedule(wanted, keep=seq_indices)
+                pictures = dict()
+                for i in seq_indices:
+                    im, local_md = self._read_seq_index(i)
+                    im.flags.writeable = False  # shared by several frames
+                    pictures[i] = im, local_md
+                pins.clear()
+                pins.update(pictures)
+                for i in frames:
+                    with self._timer('get_frame'):
+                        frame = FramesSequenceND.get_frame(self, i)
+                    yield frame
+        finally:
+            self._pinned.pop(token, None)
+
+    def _read_picture(self, coords):
+        """Decodes the picture at `coords`. Returns a read-only array with
+        shape (y, x) or (y, x, c) and the metadata."""
+        if self._pool.closed:
+            raise IOError('File is closed, unable to read data')
+
+        im, local_md = self._read_seq_index(self.get_seq_index(**coords))
+
+        metadata = dict(local_md)
+        metadata.update(self._image_metadata())
+        metadata.update(coords)
+        return im, metadata
+
+    def _image_metadata(self):
+        """Returns the metadata that all frames share: the channel colors,
+        the pixel size at the current scale and the maximum pixel value."""
+        metadata = {'colors': self.colors,
+                    'mpp': self.calibration / self._scale,
                     'max_value': self.max_value}
         if hasattr(self, 'calibrationZ'):
             metadata['mppZ'] = self.calibrationZ
-        metadata.update(coords)
-        return Frame(im, metadata=metadata)
+        return metadata
+
+    def _map(self, func, workers, *iterables):
+        """Returns the list of `func` applied to the items of `iterables`.
+        With more than one worker, the calls are made in parallel threads,
+        each borrowing an SDK handle. `workers` defaults to the number of
+        SDK handles."""
+        args = list(zip(*iterables))
+        if workers is None:
+            workers = self._pool.size
+        if workers <= 1 or len(args) <= 1:
+            return [func(*a) for a in args]
+        with ThreadPoolExecutor(min(workers, len(args))) as executor:
+            # list() raises the first exception of the workers, if any
+            return list(executor.map(func, *zip(*args)))
+
+    def get_frame_2D(self, **coords):
+        with self._timer('get_frame_2D'):
+            im, metadata = self._read_picture(coords)
+            with self._timer('copy', im.nbytes):
+                if self._shared_pictures:  # a read-only view
+                    if im.ndim == 3:
+                        im = im[:, :, coords.get('c', 0)]
+                elif im.ndim == 3:
+                    im = im[:, :, coords.get('c', 0)].copy()
+                elif not im.flags.writeable:
+                    im = im.copy()
+            with self._timer('frame'):
+                return Frame(im, metadata=metadata)
+
+    def get_frame_cyx(self, **coords):
+        """Returns all channels at once, with shape (c, y, x). The picture is
+        decoded only once, instead of once per channel."""
+        with self._timer('get_frame_cyx'):
+            im, metadata = self._read_picture(coords)
+            with self._timer('copy', im.nbytes):
+                im = np.rollaxis(im, 2)
+                if not self._shared_pictures:
+                    im = im.copy()
+            with self._timer('frame'):
+                metadata.pop('c', None)
+                return Frame(im, metadata=metadata)
+
+    def _check_out(self, out, shape):
+        if not isinstance(out, np.ndarray):
+            raise TypeError('out should be a numpy ndarray')
+        if out.dtype != self.pixel_type:
+            raise ValueError('out should have dtype {}, got {}'.format(
+                             np.dtype(self.pixel_type), out.dtype))
+        if out.shape != tuple(shape):
+            raise ValueError('out should have shape {}, got {}'.format(
+                             tuple(shape), out.shape))
+        if not out.flags.writeable:
+            raise ValueError('out is not writeable')
+
+    def read_into(self, out, **coords):
+        """Reads one frame into the preallocated array `out`, and returns it.
+
+        Coordinates that are not given are taken from `default_coords`.
+        When `out` has the (y, x, c) layout of an SDK picture (or (y, x) for
+        single channel files) and is C-contiguous, the SDK decodes directly
+        into it. Arrays of shape (c, y, x) receive all channels and arrays of
+        shape (y, x) receive channel `c`, at the cost of one copy."""
+        if self._pool.closed:
+            raise IOError('File is closed, unable to read data')
+        _coords = dict(self.default_coords)
+        _coords.update(coords)
+        shape = self._lim_frame_shape
+        if out.shape == shape and out.flags.c_contiguous:
+            self._check_out(out, shape)
+            self._read_seq_index_into(self.get_seq_index(**_coords), out)
+            return out
+
+        if 'c' in self.axes and out.ndim == 3:
+            self._check_out(out, (self.sizes['c'],) + shape[:2])
+            im, _ = self._read_picture(_coords)
+            np.copyto(out, np.rollaxis(im, 2))
+        else:
+            self._check_out(out, shape[:2])
+            im, _ = self._read_picture(_coords)
+            if im.ndim == 3:
+                im = im[:, :, _coords.get('c', 0)]
+            np.copyto(out, im)
+        return out
+
+    def read_frames_into(self, out, seq_indices, workers=None):
+        """Reads the SDK pictures at `seq_indices` into the preallocated,
+        C-contiguous array `out` of shape (len(seq_indices), y, x[, c]), and
+        returns it. The SDK decodes directly into `out`, without copies.
+
+        With more than one worker, pictures are decoded in parallel threads,
+        each borrowing an SDK handle (see the `handles` parameter). The
+        number of workers defaults to the number of SDK handles."""
+        if self._pool.closed:
+            raise IOError('File is closed, unable to read data')
+        seq_indices = [int(i) for i in seq_indices]
+        self._check_out(out, (len(seq_indices),) + self._lim_frame_shape)
+        if not out.flags.c_contiguous:
+            raise ValueError('out should be C-contiguous')
+        self._map(self._read_seq_index_into, workers, seq_indices, out)
+        return out
+
+    def get_frames(self, seq_indices, workers=None):
+        """Decodes the SDK pictures at `seq_indices` in parallel threads and
+        returns them in one array of shape (len(seq_indices), y, x[, c]).
+        The number of workers defaults to the number of SDK handles."""
+        out = np.empty((len(seq_indices),) + self._lim_frame_shape,
+                       dtype=self.pixel_type)
+        return self.read_frames_into(out, seq_indices, workers)
+
+    def read_block(self, workers=None, **coords):
+        """Reads a block of pictures into one array, allocated once.
+
+        Each of the t, m, o, z and c coordinates may be an int, which drops
+        the axis, or a slice or a list, which keeps it. Coordinates that are
+        not given are taken from `default_coords`. The axes of the result are
+        the kept axes in the order t, m, o, c, z, followed by y and x.
+
+        Every SDK picture in the block is decoded once, in sequence index
+        order, even if it appears several times. Single channel pictures are
+        decoded directly into the result. The stage positions and times of
+        the pictures are given in the metadata as arrays over the kept t, m,
+        o and z axes, with 'axes' listing all axes of the result.
+
+        With more than one worker, pictures are decoded in parallel threads,
+        each borrowing an SDK handle (see the `handles` parameter). The
+        number of workers defaults to the number of SDK handles.
+
+        Examples
+        ----------
+        >>> block = reader.read_block(t=slice(0, 10), z=[2, 3], c=0)
+        >>> block.shape  # (t, z, y, x)
+        (10, 2, 512, 512)
+        """
+        if self._pool.closed:
+            raise IOError('File is closed, unable to read data')
+        values = dict()
+        kept = []
+        for k in 'tmocz':
+            size = self.sizes.get(k, 1)
+            value = coords.pop(k, self.default_coords.get(k, 0))
+            keep = isinstance(value, slice) or np.ndim(value) != 0
+            if k not in self.sizes and (keep or value != 0):
+                raise ValueError('The file has no axis "{}"'.format(k))
+            if isinstance(value, slice):
+                values[k] = np.arange(size)[value]
+            else:
+                values[k] = np.atleast_1d(np.asarray(value, dtype=np.intp))
+                if values[k].ndim != 1:
+                    raise ValueError('Coordinates should be ints, slices or '
+                                     'one-dimensional lists')
+                if np.any((values[k] < 0) | (values[k] >= size)):
+                    raise IndexError('Coordinate {} out of range for axis '
+                                     '"{}" of size {}'.format(value, k, size))
+            if keep:
+                kept.append(k)
+        if coords:
+            raise ValueError('Unknown axes {}'.format(sorted(coords)))
+
+        # seq indices at (t, m, o, z) and the unique pictures among them
+        loop_shape = tuple(len(values[k]) for k in 'tmoz')
+        grid = self.get_seq_index(**dict(zip('tmoz', np.ix_(
+            *[values[k] for k in 'tmoz']))))
+        grid = np.broadcast_to(grid, loop_shape).ravel()
+        unique, positions = _group_pictures(grid)
+
+        channels = values['c']
+        height, width = self._lim_frame_shape[:2]
+        full = np.empty(loop_shape[:3] + (len(channels), loop_shape[3],
+                                          height, width), self.pixel_type)
+        local_md = np.empty((len(grid), 4), dtype=np.float64)
+
+        def read(i, where):
+            where = [np.unravel_index(j, loop_shape) for j in where]
+            (t, m, o, z), rest = where[0], where[1:]
+            if 'c' in self.axes:
+                picture = np.empty(self._lim_frame_shape, self.pixel_type)
+                md = self._read_seq_index_into(i, picture)
+                full[t, m, o, :, z] = np.moveaxis(picture, 2, 0)[channels]
+            else:
+                md = self._read_seq_index_into(i, full[t, m, o, 0, z])
+            for t2, m2, o2, z2 in rest:
+                full[t2, m2, o2, :, z2] = full[t, m, o, :, z]
+            return md
+
+        mds = self._map(read, workers, unique, positions)
+        for md, where in zip(mds, positions):
+            local_md[where] = [md[k] for k in ('t_ms', 'x_um', 'y_um',
+                                               'z_um')]
+
+        shape = tuple(len(values[k]) for k in kept) + (height, width)
+        md_shape = tuple(len(values[k]) for k in kept if k != 'c')
+        metadata = self._image_metadata()
+        metadata['axes'] = kept + ['y', 'x']
+        for k, field in zip(('t_ms', 'x_um', 'y_um', 'z_um'), local_md.T):
+            metadata[k] = field.reshape(md_shape)
+        for k in 'tmocz':
+            if k in self.sizes:
+                metadata[k] = values[k] if k in kept else int(values[k][0])
+        return Frame(full.reshape(shape), metadata=metadata)
+
+    def get_volume(self, t=None, m=None, workers=None, **coords):
+        """Reads the z stack at time point `t` and position `m`, with all
+        channels, into one array with shape (c, z, y, x), (z, y, x) or
+        (c, y, x). Coordinates that are not given are taken from
+        `default_coords`, except z and c. Pass an int `c` to read one
+        channel. See `read_block`."""
+        if t is not None:
+            coords['t'] = t
+        if m is not None:
+            coords['m'] = m
+        for k in 'cz':
+            if k in self.sizes:
+                coords.setdefault(k, slice(None))
+        return self.read_block(workers=workers, **coords)
+
+    def project(self, axis='z', op='max', workers=None):
+        """Returns the projection along `axis` (t, m, z or o) as a lazy
+        FramesSequenceND over the other axes, e.g. the maximum intensity
+        projection over z, or the mean over t.
+
+        `op` is 'max', 'min', 'sum', 'mean' or 'std'. Frames are computed
+        when they are read, by streaming the pictures along the axis in
+        sequence index order into running accumulators, so that the stack
+        is never in memory at once. Each picture is read once for all
+        channels. The pictures are split over `workers` threads, which
+        defaults to the number of SDK handles.
+
+        Examples
+        ----------
+        >>> mip = reader.project('z', 'max')
+        >>> mip.bundle_axes = 'cyx'
+        >>> mip[0].shape  # (c, y, x) at t=0
+        (2, 512, 512)
+        """
+        return ND2_Projection(self, axis, op, workers)
+
+    def read_boxes(self, boxes, c=None, workers=None, fill_value=0):
+        """Crops many boxes out of the pictures of the file, e.g. the cells
+        of a segmentation or tracking table, into one array.
+
+        `boxes` is a table with the columns t, m, z, y0, x0, h and w: an
+        array of shape (n, 7) in that order, or a pandas DataFrame, a
+        structured array or a dict with these columns. Missing t, m and z
+        columns are taken from `default_coords`. Boxes are in pixels of the
+        frames of the reader, i.e. within the region of interest and at the
+        current scale.
+
+        The boxes are grouped by SDK picture, which is read once for all its
+        boxes and channels, in sequence index order. The crops of a picture
+        are extracted with one indexing operation. With more than one worker,
+        pictures are read in parallel threads, each borrowing an SDK handle
+        (see the `handles` parameter). The number of workers defaults to the
+        number of SDK handles.
+
+        The crops are stacked into one array of shape (n, c, h, w) for all
+        channels, (n, h, w) for an int `c` or a file without channels, or
+        (n, len(c), h, w) for a list of channels. Its height and width are
+        the largest of the boxes; smaller boxes and the parts of boxes
+        outside the picture are filled with `fill_value`. The sequence
+        index, stage position and time of the picture of each box are given
+        in the metadata.
+
+        Examples
+        ----------
+        >>> crops = reader.read_boxes(cells[['t', 'z', 'y0', 'x0', 'h',
+        ...                                  'w']], c=[0, 1])
+        >>> crops.shape
+        (850, 2, 24, 24)
+        """
+        if self._pool.closed:
+            raise IOError('File is closed, unable to read data')
+        names = ('t', 'm', 'z', 'y0', 'x0', 'h', 'w')
+        columns = getattr(getattr(boxes, 'dtype', None), 'names', None)
+        if columns is None and hasattr(boxes, 'keys'):
+            columns = list(boxes.keys())  # a DataFrame or dict
+        if columns is not None:
+            for k in ('y0', 'x0', 'h', 'w'):
+                if k not in columns:
+                    raise ValueError('The boxes have no column "{}"'.format(k))
+            n = len(boxes['y0'])
+            table = [np.asarray(boxes[k], dtype=np.intp) if k in columns
+                     else np.full(n, self.default_coords.get(k, 0), np.intp)
+                     for k in names]
+        else:
+            table = np.asarray(boxes, dtype=np.intp)
+            if table.ndim != 2 or table.shape[1] != len(names):
+                raise ValueError('boxes should have shape (n, 7), got '
+                                 '{}'.format(table.shape))
+            table = list(table.T)
+        t, m, z, y0, x0, box_h, box_w = table
+        if np.any(box_h < 1) or np.any(box_w < 1):
+            raise ValueError('Boxes should be at least 1 pixel high and wide')
+
+        loop = dict()
+        for k, values in zip('tmz', (t, m, z)):
+            if k in self.sizes:
+                loop[k] = values
+            elif np.any(values != 0):
+                raise ValueError('The file has no axis "{}"'.format(k))
+        seq = np.asarray(self.get_seq_index(**loop), dtype=np.intp)
+        seq = np.broadcast_to(seq, t.shape)
+        unique, groups = _group_pictures(seq)
+
+        if 'c' in self.sizes:
+            channels = np.arange(self.sizes['c'])[
+                slice(None) if c is None else c]
+        elif c not in (None, 0):
+            raise ValueError('The file has no axis "c"')
+        else:
+            channels = None
+        height, width = self._lim_frame_shape[:2]
+        out_h = int(box_h.max()) if len(seq) else 0
+        out_w = int(box_w.max()) if len(seq) else 0
+        rows = np.arange(out_h)
+        cols = np.arange(out_w)
+        n_channels = 1 if channels is None else np.size(channels)
+        out = np.empty((len(seq), n_channels, out_h, out_w), self.pixel_type)
+        local_md = np.empty((len(seq), 4), dtype=np.float64)
+
+        def read(i, where):
+            if self.memmap or self._shared_pictures:
+                picture, md = self._read_seq_index(i)
+            else:
+                picture = np.empty(self._lim_frame_shape, self.pixel_type)
+                md = self._read_seq_index_into(i, picture)
+            if picture.ndim == 2:
+                picture = picture[:, :, np.newaxis]
+            if channels is not None:
+                picture = picture[:, :, np.atleast_1d(channels)]
+            ys = y0[where, np.newaxis] + rows  # (boxes, h)
+            xs = x0[where, np.newaxis] + cols  # (boxes, w)
+            valid_y = (ys >= 0) & (ys < height) & \
+                (rows < box_h[where, np.newaxis])
+            valid_x = (xs >= 0) & (xs < width) & \
+                (cols < box_w[where, np.newaxis])
+            crops = picture[np.clip(ys, 0, height - 1)[:, :, np.newaxis],
+                            np.clip(xs, 0, width - 1)[:, np.newaxis, :]]
+            crops[~(valid_y[:, :, np.newaxis] & valid_x[:, np.newaxis, :])] = \
+                fill_value
+            out[where] = np.moveaxis(crops, 3, 1)
+            local_md[where] = [md[k] for k in ('t_ms', 'x_um', 'y_um',
+                                               'z_um')]
+
+        self._map(read, workers, [int(i) for i in unique], groups)
+
+        if channels is None or np.ndim(channels) == 0:
+            out = out[:, 0]
+            axes = ['box', 'y', 'x']
+        else:
+            axes = ['box', 'c', 'y', 'x']
+        metadata = self._image_metadata()
+        metadata.update(axes=axes, seq_index=seq)
+        if channels is not None:
+            metadata['c'] = channels
+        for k, field in zip(('t_ms', 'x_um', 'y_um', 'z_um'), local_md.T):
+            metadata[k] = field
+        return Frame(out, metadata=metadata)
+
+    def _get_executor(self):
+        """Returns the executor of the asyncio methods, with one thread per
+        SDK handle."""
+        self._check_fork()
+        with self._executor_lock:
+            if self._pool.closed:
+                raise IOError('File is closed, unable to read data')
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._pool.size)
+            return self._executor
+
+    def aget_frame(self, i):
+        """Coroutine that returns frame `i`, like `get_frame`, without
+        blocking the event loop (Python 3.7+).
+
+        Reads run on an executor with one thread per SDK handle, so that
+        `handles` reads run in parallel. At most a few reads per handle are
+        queued, per event loop; further reads wait in the event loop.
+        Cancelling a read that did not start yet removes it from the queue.
+
+        Examples
+        ----------
+        >>> frame = await reader.aget_frame(0)
+        """
+        from .aio import aget_frame
+        return aget_frame(self, i)
+
+    def aget_frame_2D(self, **coords):
+        """Coroutine that returns the plane at `coords`, like `get_frame_2D`,
+        without blocking the event loop. See `aget_frame`."""
+        from .aio import aget_frame_2D
+        return aget_frame_2D(self, **coords)
+
+    def aiter_frames(self, indices=None, ahead=None):
+        """Asynchronous iterator over the frames `indices` (by default all
+        frames), in order. At most `ahead` frames are read ahead of the
+        consumer, which defaults to the number of SDK handles. A slow
+        consumer therefore holds up the reading, and leaving the loop
+        cancels the reads that did not start yet. `async for frame in
+        reader` iterates over all frames.
+
+        Examples
+        ----------
+        >>> async for frame in reader.aiter_frames(range(10)):
+        ...     await websocket.send(frame.tobytes())
+        """
+        from .aio import aiter_frames
+        return aiter_frames(self, indices, ahead)
+
+    def __aiter__(self):
+        return self.aiter_frames()
+
+    def to_dask(self, chunks=None):
+        """Returns a lazy dask array over all axes, in the order t, m, o, z,
+        c, y, x. Axes that are not present are left out. The region of
+        interest and scale of the reader are applied.
+
+        Parameters
+        ----------
+        chunks : dict, optional
+            Chunk size per axis name, e.g. {'z': 10}. By default, each chunk
+            is one SDK picture with all channels. Any other value is passed
+            on to `dask.array.from_array`.
+
+        The dask graph only contains the file name and reading options.
+        Tasks share one open reader per process, instead of opening the file
+        for each chunk."""
+        from .dask_array import to_dask
+        return to_dask(self, chunks)
 
     @property
     def metadata(self):
@@ -245,6 +1469,7 @@ class ND2_Reader(FramesSequenceND):
 
                     'z_home': self._z_home,
                     'frame_rate': self.frame_rate}
+        metadata.update(self._large_image_dimensions())
         for i in range(bufmd.uiPlaneCount):
             plane = bufmd.pPlanes[i]
             metadata['plane_{}'.format(i)] = {'components': plane.uiCompCount,
@@ -255,13 +1480,33 @@ class ND2_Reader(FramesSequenceND):
 
         return metadata
 
+    def _large_image_dimensions(self):
+        """Returns the number of fields and their overlap of stitched large
+        images, or an empty dict for other files."""
+        if self._large_image is None:
+            fields_x, fields_y, overlap = h.LIMUINT(), h.LIMUINT(), c_double()
+            try:
+                with self._pool.handle() as handle:
+                    h.Lim_GetLargeImageDimensions(handle, byref(fields_x),
+                                                  byref(fields_y),
+                                                  byref(overlap))
+            except Exception:  # the SDK fails for files that are not stitched
+                self._large_image = dict()
+            else:
+                self._large_image = {'large_image_fields_x': fields_x.value,
+                                     'large_image_fields_y': fields_y.value,
+                                     'large_image_overlap': overlap.value}
+            self._update_index()
+        return dict(self._large_image)
+
     @property
     def metadata_text(self):
         if hasattr(self, '_lim_textinfo'):
             buft = self._lim_textinfo
         else:
             buft = h.LIMTEXTINFO()
-            h.Lim_FileGetTextinfo(self._handle, buft)
+            with self._pool.handle() as handle:
+                h.Lim_FileGetTextinfo(handle, buft)
             self._lim_textinfo = buft
         return buft.wszDescription  # wszCapturing is contained in Description
 
@@ -269,11 +1514,107 @@ class ND2_Reader(FramesSequenceND):
     def pixel_type(self):
         return self._pixel_type
 
+    @property
+    def roi(self):
+        return self._roi
+
+    @roi.setter
+    def roi(self, value):
+        self._set_rect(value, self._scale)
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, value):
+        self._set_rect(self._roi, value)
+
+    def _set_rect(self, roi, scale):
+        """Sets the region of interest and the scale, and updates the frame
+        shape accordingly."""
+        attr = self._lim_attributes
+        scale = float(scale)
+        if not 0 < scale <= 1:
+            raise ValueError('The scale should be larger than 0 and at most '
+                             '1, got {}'.format(scale))
+        if roi is not None:
+            y0, y1, x0, x1 = [int(v) for v in roi]
+            if not (0 <= y0 < y1 <= attr.uiHeight and
+                    0 <= x0 < x1 <= attr.uiWidth):
+                raise ValueError('The region of interest {} does not fit in '
+                                 'pictures of shape {}'.format(
+                                 (y0, y1, x0, x1),
+                                 (attr.uiHeight, attr.uiWidth)))
+            roi = (y0, y1, x0, x1)
+        else:
+            y0, y1, x0, x1 = 0, attr.uiHeight, 0, attr.uiWidth
+
+        if scale != 1:
+            # the SDK takes the rectangle in the coordinates of the scaled
+            # picture: keep at least one pixel
+            total_h = max(int(round(attr.uiHeight * scale)), 1)
+            total_w = max(int(round(attr.uiWidth * scale)), 1)
+            y0 = min(int(round(y0 * scale)), total_h - 1)
+            x0 = min(int(round(x0 * scale)), total_w - 1)
+            y1 = min(max(int(round(y1 * scale)), y0 + 1), total_h)
+            x1 = min(max(int(round(x1 * scale)), x0 + 1), total_w)
+        else:
+            total_h, total_w = attr.uiHeight, attr.uiWidth
+        height, width = y1 - y0, x1 - x0
+
+        self._roi = roi
+        self._scale = scale
+        self._rect = (total_h, total_w, y0, y1, x0, x1)
+        self._sizes['y'] = height
+        self._sizes['x'] = width
+        self._lim_frame_shape = (height, width) + self._lim_frame_shape[2:]
+        self.clear_cache()
+        if self._prefetcher is not None:
+            self._prefetcher.flush()
+        # pinned pictures have the previous shape
+        for pins in list(self._pinned.values()):
+            pins.clear()
+        # rebuild the frame getter for the new frame shape
+        self.bundle_axes = self.bundle_axes
+
+    @property
+    def frame_table(self):
+        if self._frame_table is None:
+            n = self._lim_attributes.uiSequenceCount
+            table = np.empty(n, dtype=[('seq_index', np.intp),
+                                       ('t', np.intp), ('m', np.intp),
+                                       ('z', np.intp), ('o', np.intp),
+                                       ('t_ms', np.float64),
+                                       ('x_um', np.float64),
+                                       ('y_um', np.float64),
+                                       ('z_um', np.float64)])
+            table['seq_index'] = np.arange(n)
+            for k, values in zip('tmzo', self.coords_table.T):
+                table[k] = values
+            local_md = np.empty((n, 4), dtype=np.float64)
+            with self._pool.handle() as handle:
+                for i in range(n):
+                    local_md[i] = self._local_metadata(i, handle)
+            for k, values in zip(('t_ms', 'x_um', 'y_um', 'z_um'),
+                                 local_md.T):
+                table[k] = values
+            self._frame_table = table
+            self._update_index()
+        return self._frame_table
+
     @property
     def frame_rate(self):
-        if self._frame_rate is None and len(self) > 1:
-            length = len(self)
-            t_first = self.get_frame_2D(t=0).metadata['t_ms']
-            t_last = self.get_frame_2D(t=length-1).metadata['t_ms']
+        length = self.sizes.get('t', 1)
+        if self._frame_rate is None and length > 1:
+            first = self.get_seq_index(t=0)
+            last = self.get_seq_index(t=length - 1)
+            if self._frame_table is not None:
+                t_first = self._frame_table['t_ms'][first]
+                t_last = self._frame_table['t_ms'][last]
+            else:
+                with self._pool.handle() as handle:
+                    t_first = self._local_metadata(first, handle)[0]
+                    t_last = self._local_metadata(last, handle)[0]
             self._frame_rate = 1000 * (length - 1) / (t_last - t_first)
         return self._frame_rate
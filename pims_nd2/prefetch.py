@@ -0,0 +1,144 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import weakref
+from collections import deque
+from threading import Condition, Thread, current_thread
+
+
+class _WeakMethod(object):
+    """Reference to a bound method that does not keep its object alive.
+    Calling it returns the bound method, or None once the object is
+    deleted. Other callables are returned as they are."""
+    def __init__(self, method):
+        obj = getattr(method, '__self__', None)
+        if obj is None:
+            self._ref, self._func = None, method
+        else:
+            self._ref, self._func = weakref.ref(obj), method.__func__
+
+    def __call__(self):
+        if self._ref is None:
+            return self._func
+        obj = self._ref()
+        return None if obj is None else self._func.__get__(obj, type(obj))
+
+
+class Prefetcher(object):
+    """Decodes pictures ahead of the reader on a background thread.
+
+    The reader tells the prefetcher which sequence indices it expects to
+    read next, using `schedule`. A background thread decodes them in that
+    order with its own SDK handle. The reader then collects them with
+    `take`. Scheduling other indices (e.g. after a seek) cancels the
+    outstanding work and drops the pictures that are no longer expected.
+
+    Parameters
+    ----------
+    decode : callable
+        Function `decode(seq_index, handle)` that returns a picture and its
+        metadata.
+    open_handle : callable
+        Function that opens an SDK file handle. The background thread opens
+        its own handle when it gets work for the first time.
+    close_handle : callable
+        Function that closes the handle.
+
+    Bound methods are referenced weakly, so that the background thread does
+    not keep the reader alive. The thread stops when the reader is deleted.
+    """
+    def __init__(self, decode, open_handle, close_handle):
+        self._decode = _WeakMethod(decode)
+        self._handle = None
+        self._open_handle = _WeakMethod(open_handle)
+        self._close_handle = close_handle
+        self._cond = Condition()
+        self._wanted = deque()
+        self._ready = dict()
+        self._busy = None
+        self._generation = 0
+        self._capacity = 0
+        self._closed = False
+        self._thread = Thread(target=self._run, name='pims_nd2-prefetch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, wanted, keep=()):
+        """Replaces the outstanding work by the sequence indices `wanted`,
+        which are decoded in order. Decoded pictures that are neither in
+        `wanted` nor in `keep` are dropped."""
+        with self._cond:
+            keep = set(keep).union(wanted)
+            for i in list(self._ready):
+                if i not in keep:
+                    del self._ready[i]
+            self._wanted.clear()
+            for i in wanted:
+                if (i not in self._ready and i != self._busy and
+                        i not in self._wanted):
+                    self._wanted.append(i)
+            self._capacity = len(keep)
+            self._cond.notify_all()
+
+    def take(self, i):
+        """Returns the decoded picture `i` and its metadata, or None if it was
+        not prefetched. Waits if `i` is being decoded at the moment."""
+        with self._cond:
+            while self._busy == i and not self._closed:
+                self._cond.wait()
+            result = self._ready.pop(i, None)
+            self._cond.notify_all()
+            return result
+
+    def flush(self):
+        """Drops all outstanding work and decoded pictures, for instance when
+        the shape of the pictures changes."""
+        with self._cond:
+            self._generation += 1
+            self._wanted.clear()
+            self._ready.clear()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._wanted or
+                        len(self._ready) >= self._capacity):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                i = self._wanted.popleft()
+                self._busy = i
+                generation = self._generation
+            decode, open_handle = self._decode(), self._open_handle()
+            if decode is None or open_handle is None:  # reader deleted
+                self.close()
+                return
+            try:
+                if self._handle is None:
+                    self._handle = open_handle()
+                result = decode(i, self._handle)
+            except Exception:
+                result = None  # the reader will decode it again and raise
+            # the reader may be deleted, and close the prefetcher, here
+            del decode, open_handle
+            with self._cond:
+                self._busy = None
+                if result is not None and generation == self._generation:
+                    self._ready[i] = result
+                self._cond.notify_all()
+
+    def close(self):
+        """Stops the background thread and closes its handle."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._wanted.clear()
+            self._ready.clear()
+            self._cond.notify_all()
+        if self._thread is not current_thread():
+            self._thread.join()
+        if self._handle is not None:
+            self._close_handle(self._handle)
+            self._handle = None
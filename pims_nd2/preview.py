@@ -0,0 +1,58 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+from .nd2reader import ND2_Reader
+
+
+def _downsample_2x(arr):
+    """Averages blocks of 2x2 pixels of an array of shape (n, y, x[, c])."""
+    height, width = arr.shape[1] // 2 * 2, arr.shape[2] // 2 * 2
+    arr = arr[:, :height, :width]
+    result = (arr[:, 0::2, 0::2].astype(np.float64) + arr[:, 1::2, 0::2] +
+              arr[:, 0::2, 1::2] + arr[:, 1::2, 1::2]) / 4
+    if np.issubdtype(arr.dtype, np.integer):
+        result = np.round(result)
+    return result.astype(arr.dtype)
+
+
+def preview_pyramid(filename, levels=3, scale=0.25, stretch='quick',
+                    **kwargs):
+    """Builds a multi-level preview pyramid of all pictures in a file.
+
+    The first level is downsampled by the SDK while reading, so that full
+    resolution pictures are never allocated. Every next level is two times
+    smaller than the previous one and is computed from it, so that each
+    picture is decoded only once.
+
+    Parameters
+    ----------
+    filename : str
+    levels : int, optional
+        Number of pyramid levels. Fewer levels are returned when pictures
+        become smaller than 1 pixel. Defaults to 3.
+    scale : float, optional
+        Downsampling factor of the first level. Defaults to 0.25.
+    stretch : {'quick', 'linear', 'splines'}, optional
+        Resampling method of the SDK. Defaults to 'quick'.
+    kwargs :
+        Passed on to ND2_Reader.
+
+    Returns
+    -------
+    list of ndarrays
+        Pyramid levels of shape (sequence_count, y, x) or
+        (sequence_count, y, x, c). Use `ND2_Reader.get_seq_index` to find the
+        sequence index of given coordinates.
+    """
+    with ND2_Reader(filename, scale=scale, stretch=stretch, **kwargs) as im:
+        n = im._lim_attributes.uiSequenceCount
+        base = np.empty((n,) + im._lim_frame_shape, dtype=im.pixel_type)
+        im.read_frames_into(base, range(n))
+
+    pyramid = [base]
+    for _ in range(levels - 1):
+        if min(pyramid[-1].shape[1:3]) < 2:
+            break
+        pyramid.append(_downsample_2x(pyramid[-1]))
+    return pyramid
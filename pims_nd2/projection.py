@@ -0,0 +1,167 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from threading import Lock
+import numpy as np
+from pims.frame import Frame
+from pims.base_frames import FramesSequenceND
+
+PROJECTIONS = ('max', 'min', 'sum', 'mean', 'std')
+
+
+def _merge(a, b, op):
+    """Combines the running projections (count, accumulator, sum of squared
+    differences) of two groups of pictures."""
+    n_a, acc_a, m2_a = a
+    n_b, acc_b, m2_b = b
+    n = n_a + n_b
+    if op == 'max':
+        return n, np.maximum(acc_a, acc_b, out=acc_a), None
+    if op == 'min':
+        return n, np.minimum(acc_a, acc_b, out=acc_a), None
+    if op in ('sum', 'mean'):
+        return n, np.add(acc_a, acc_b, out=acc_a), None
+    # std: running means, merged as in Chan et al.
+    delta = acc_b - acc_a
+    acc_a += delta * (n_b / n)
+    m2_a += m2_b
+    m2_a += delta ** 2 * (n_a * n_b / n)
+    return n, acc_a, m2_a
+
+
+class ND2_Projection(FramesSequenceND):
+    """Projection of an ND2_Reader along one of the t, m, z or o axes, see
+    `ND2_Reader.project`.
+
+    Frames are computed when they are read. The pictures along the axis are
+    read one by one in sequence index order, and reduced into running
+    accumulators, so that only one picture per worker and the accumulators
+    are in memory. All channels are projected at once: the last projection
+    is kept, so that reading the other channels does not read the pictures
+    again.
+
+    Attributes
+    ----------
+    reader : ND2_Reader
+    axis : str
+        The axis that is projected.
+    op : {'max', 'min', 'sum', 'mean', 'std'}
+    workers : int
+        Number of threads that each read a part of the pictures.
+    """
+    def __init__(self, reader, axis='z', op='max', workers=None):
+        super(ND2_Projection, self).__init__()
+        if axis not in 'tmzo' or axis not in reader.sizes:
+            raise ValueError('Cannot project along axis "{}", the axes are '
+                             '{}'.format(axis, reader.axes))
+        if op not in PROJECTIONS:
+            raise ValueError('Unknown projection "{}", use one of '
+                             '{}'.format(op, PROJECTIONS))
+        self.reader = reader
+        self.axis = axis
+        self.op = op
+        self.workers = reader._pool.size if workers is None else workers
+        self._last = None
+        self._lock = Lock()
+        if op in ('max', 'min'):
+            self._pixel_type = np.dtype(reader.pixel_type)
+        elif op == 'sum' and np.issubdtype(reader.pixel_type, np.integer):
+            self._pixel_type = np.dtype(np.uint64)
+        else:
+            self._pixel_type = np.dtype(np.float64)
+
+        for k in reader.axes:
+            if k != axis:
+                self._init_axis(k, reader.sizes[k])
+        for k, value in reader.default_coords.items():
+            if k in self.sizes:
+                self.default_coords[k] = value
+        self._register_get_frame(self.get_frame_2D, 'yx')
+        if 'c' in self.axes:
+            self._register_get_frame(self.get_frame_cyx, 'cyx')
+        if 'z' in self.axes:
+            self.bundle_axes = 'zyx'
+        if 't' in self.axes:
+            self.iter_axes = 't'
+
+    @property
+    def pixel_type(self):
+        return self._pixel_type
+
+    def _read(self, i, buf):
+        """Returns picture `i`, read into `buf` unless the reader gives views
+        on shared memory or on the memory map of the file."""
+        if self.reader.memmap or self.reader._shared_pictures:
+            return self.reader._read_seq_index(i)[0]
+        self.reader._read_seq_index_into(i, buf)
+        return buf
+
+    def _accumulate(self, seq_indices):
+        """Projects the pictures `seq_indices`. Returns the count, the
+        accumulator and, for 'std', the sum of squared differences from the
+        mean."""
+        reader = self.reader
+        buf = np.empty(reader._lim_frame_shape, reader.pixel_type)
+        acc, m2 = None, None
+        for n, i in enumerate(seq_indices, 1):
+            im = self._read(int(i), buf)
+            if acc is None:
+                acc = im.astype(self._pixel_type)
+                if self.op == 'std':
+                    m2 = np.zeros_like(acc)
+            elif self.op == 'max':
+                np.maximum(acc, im, out=acc)
+            elif self.op == 'min':
+                np.minimum(acc, im, out=acc)
+            elif self.op in ('sum', 'mean'):
+                np.add(acc, im, out=acc, casting='unsafe')
+            else:  # Welford's running mean and squared differences
+                delta = im - acc
+                acc += delta / n
+                m2 += delta * (im - acc)
+        return len(seq_indices), acc, m2
+
+    def _project(self, coords):
+        """Returns the projection with shape (y, x[, c]) at the coordinates
+        of the other axes. The result is shared: do not modify it."""
+        key = tuple(int(coords.get(k, 0)) for k in 'tmzo'
+                    if k in self.sizes)
+        with self._lock:
+            if self._last is not None and self._last[0] == key:
+                return self._last[1]
+        loop_coords = dict(zip([k for k in 'tmzo' if k in self.sizes], key))
+        loop_coords[self.axis] = np.arange(self.reader.sizes[self.axis])
+        # in file order
+        seq_indices = np.unique(self.reader.get_seq_index(**loop_coords))
+        chunks = np.array_split(seq_indices,
+                                max(min(self.workers, len(seq_indices)), 1))
+        parts = self.reader._map(self._accumulate, len(chunks), chunks)
+        result = parts[0]
+        for part in parts[1:]:
+            result = _merge(result, part, self.op)
+        n, result, m2 = result
+        if self.op == 'mean':
+            result /= n
+        elif self.op == 'std':
+            result = np.sqrt(m2 / n)
+        with self._lock:
+            self._last = key, result
+        return result
+
+    def _metadata(self, coords):
+        metadata = self.reader._image_metadata()
+        metadata.update(projection=self.op, projection_axis=self.axis)
+        metadata.update(coords)
+        return metadata
+
+    def get_frame_2D(self, **coords):
+        im = self._project(coords)
+        if im.ndim == 3:
+            im = im[:, :, coords.get('c', 0)]
+        return Frame(im.copy(), metadata=self._metadata(coords))
+
+    def get_frame_cyx(self, **coords):
+        im = np.rollaxis(self._project(coords), 2).copy()
+        metadata = self._metadata(coords)
+        metadata.pop('c', None)
+        return Frame(im, metadata=metadata)
@@ -0,0 +1,125 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import struct
+import numpy as np
+
+CHUNK_MAGIC = 0x0ABECEDA
+CHUNK_MAP_SIGNATURE = b'ND2 CHUNK MAP SIGNATURE 0000001!'
+_CHUNK_HEADER = struct.Struct('<IIQ')  # magic, name length, data length
+_TIMESTAMP_SIZE = 8  # each picture starts with its time in ms (double)
+
+
+def read_chunk_map(filename):
+    """Reads the chunk map at the end of an ND2 file (version 3 and later),
+    and returns a dict of chunk name (bytes) to the position and length of
+    the chunk data. Raises ValueError for files without chunk map."""
+    with open(filename, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        if size < len(CHUNK_MAP_SIGNATURE) + 8:
+            raise ValueError('File too small for an ND2 chunk map')
+        f.seek(-len(CHUNK_MAP_SIGNATURE) - 8, 2)
+        tail = f.read(len(CHUNK_MAP_SIGNATURE) + 8)
+        if not tail.startswith(CHUNK_MAP_SIGNATURE):
+            raise ValueError('No ND2 chunk map found')
+        position, = struct.unpack('<Q', tail[-8:])
+        if position + _CHUNK_HEADER.size > size:
+            raise ValueError('Invalid ND2 chunk map position')
+        f.seek(position)
+        magic, name_length, data_length = _CHUNK_HEADER.unpack(
+            f.read(_CHUNK_HEADER.size))
+        if magic != CHUNK_MAGIC:
+            raise ValueError('Invalid ND2 chunk map')
+        f.seek(name_length, 1)
+        data = f.read(data_length)
+
+    chunks = dict()
+    pos = 0
+    while pos < len(data):
+        end = data.find(b'!', pos) + 1
+        if end == 0:
+            raise ValueError('Truncated ND2 chunk map')
+        name = data[pos:end]
+        if name == CHUNK_MAP_SIGNATURE:
+            break
+        if end + 16 > len(data):
+            raise ValueError('Truncated ND2 chunk map')
+        chunks[name] = struct.unpack('<QQ', data[end:end + 16])
+        pos = end + 16
+    return chunks
+
+
+class RawPictureMap(object):
+    """Memory map of the pictures of an uncompressed ND2 file.
+
+    The chunk map of the file gives the position of each picture. Pictures
+    are then served as read-only numpy views on the file, without the SDK
+    and without copying, so that reads are as fast as the page cache and
+    several processes share the same memory.
+
+    Parameters
+    ----------
+    filename : str
+    count : int
+        Number of pictures (sequence indices).
+    shape : tuple of int
+        Shape (y, x[, c]) of the pictures.
+    dtype : numpy.dtype
+    width_bytes : int
+        Number of bytes per row of pixels, including padding.
+
+    Raises ValueError when the file layout does not match.
+    """
+    def __init__(self, filename, count, shape, dtype, width_bytes):
+        dtype = np.dtype(dtype).newbyteorder('<')
+        chunks = read_chunk_map(filename)
+        height = shape[0]
+        row_bytes = int(np.prod(shape[1:])) * dtype.itemsize
+        if width_bytes < row_bytes:
+            raise ValueError('Invalid row size {}'.format(width_bytes))
+        nbytes = _TIMESTAMP_SIZE + (height - 1) * width_bytes + row_bytes
+
+        self._mmap = np.memmap(filename, dtype=np.uint8, mode='r')
+        self.offsets = np.empty(count, dtype=np.int64)
+        for i in range(count):
+            try:
+                position, length = chunks[
+                    'ImageDataSeq|{}!'.format(i).encode('ascii')]
+            except KeyError:
+                raise ValueError('No data of picture {}'.format(i))
+            if length < nbytes:
+                raise ValueError('Picture {} is compressed or truncated'
+                                 .format(i))
+            magic, name_length, data_length = _CHUNK_HEADER.unpack(
+                self._mmap[position:position + _CHUNK_HEADER.size].tobytes())
+            if magic != CHUNK_MAGIC or data_length != length:
+                raise ValueError('Invalid chunk of picture {}'.format(i))
+            self.offsets[i] = position + _CHUNK_HEADER.size + name_length
+            if self.offsets[i] + nbytes > len(self._mmap):
+                raise ValueError('Picture {} is truncated'.format(i))
+
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        if len(shape) == 2:
+            self.strides = (width_bytes, dtype.itemsize)
+        else:  # interleaved components
+            self.strides = (width_bytes, shape[2] * dtype.itemsize,
+                            dtype.itemsize)
+
+    def picture(self, i):
+        """Returns a read-only view of picture `i`."""
+        offset = int(self.offsets[i]) + _TIMESTAMP_SIZE
+        return np.ndarray(self.shape, self.dtype, buffer=self._mmap,
+                          offset=offset, strides=self.strides)
+
+    def timestamp(self, i):
+        """Returns the time of picture `i`, in ms."""
+        offset = int(self.offsets[i])
+        return float(self._mmap[offset:offset + _TIMESTAMP_SIZE]
+                     .view('<f8')[0])
+
+    def close(self):
+        """Releases the memory map. Views that are still in use keep the
+        file mapped until they are deleted."""
+        self._mmap = None
@@ -0,0 +1,402 @@
+"""Frame server: decodes the pictures of an ND2 file once for several
+processes (Python 3.8+).
+
+One process runs an ND2_FrameServer, which owns the SDK handles and decodes
+each picture into a ring of slots in shared memory. Other processes open an
+ND2_FrameClient, which has the interface of ND2_Reader, and read the pictures
+as read-only views on the shared memory, without decoding and without
+copying.
+"""
+import os
+import sys
+import weakref
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener
+from threading import Condition, Lock, Thread
+import numpy as np
+from .nd2reader import ND2_Reader
+
+# names of the shared memory of the servers in this process
+_served = set()
+
+
+def _attach(name):
+    """Attaches to the shared memory `name` of a server, without letting the
+    resource tracker of this process remove it when the process ends."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    shm = shared_memory.SharedMemory(name)
+    if os.name == 'posix' and name not in _served:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class ND2_FrameServer(object):
+    """Serves the pictures of an ND2 file to ND2_FrameClient readers in
+    other processes, through shared memory.
+
+    Each picture is decoded into one of `slots` slots of shared memory, and
+    stays there until the slot is needed for another picture. Clients that
+    read the same pictures at about the same time therefore share a single
+    decode. A slot is not reused while a client still has a view on it;
+    when all slots are in use, pictures are sent as copies instead.
+
+    Requests are served on a background thread per client, so that the SDK
+    handles of the reader (see the `handles` parameter of ND2_Reader) decode
+    for several clients at the same time.
+
+    Parameters
+    ----------
+    filename : str
+    slots : int, optional
+        Number of pictures in shared memory. Defaults to 64.
+    address : str or tuple, optional
+        Address to listen on, see `multiprocessing.connection.Listener`.
+        Defaults to a new local address, see `address`.
+    authkey : bytes, optional
+        Key that clients need to connect. Defaults to a new random key, see
+        `authkey`.
+    kwargs :
+        Passed on to ND2_Reader, e.g. roi, scale or handles.
+
+    Attributes
+    ----------
+    address : str or tuple
+        The address that clients connect to.
+    authkey : bytes
+        The key that clients need to connect. Requests are unpickled, so
+        only share it with processes that are trusted.
+    reader : ND2_Reader
+        The reader that decodes the pictures. Its region of interest and
+        scale should not be changed.
+    decoded : int
+        Number of pictures decoded into shared memory.
+
+    Examples
+    ----------
+    >>> with ND2_FrameServer(filename, handles=4) as server:
+    ...     print(server.address, server.authkey.hex())
+    ...     server.serve_forever()
+
+    and in other processes:
+
+    >>> with ND2_FrameClient(address, bytes.fromhex(key)) as frames:
+    ...     for frame in frames:
+    ...         tp.locate(frame, diameter=7)
+    """
+    def __init__(self, filename, slots=64, address=None, authkey=None,
+                 **kwargs):
+        if slots < 1:
+            raise ValueError('The number of slots should be at least 1.')
+        self.slots = int(slots)
+        self.authkey = os.urandom(32) if authkey is None else authkey
+        self._shm = None
+        self._listener = None
+        self._thread = None
+        self._closed = False
+        self.reader = ND2_Reader(filename, **kwargs)
+        try:
+            reader = self.reader
+            self._shape = reader._lim_frame_shape
+            self._dtype = np.dtype(reader.pixel_type)
+            # read the whole file description once, for the clients
+            reader._index_data()
+            self._state = reader.__getstate__()
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=self.slots * self._dtype.itemsize *
+                int(np.prod(self._shape)))
+            _served.add(self._shm.name)
+            self._pictures = np.ndarray((self.slots,) + self._shape,
+                                        self._dtype, buffer=self._shm.buf)
+            self._listener = Listener(address, authkey=self.authkey)
+        except Exception:
+            self.close()
+            raise
+        self.address = self._listener.address
+
+        self._cond = Condition()
+        self._slot_of = dict()
+        self._index_of = [None] * self.slots
+        self._metadata = [None] * self.slots
+        self._ready = [False] * self.slots
+        self._refs = [0] * self.slots
+        # slots that no client uses, least recently used first
+        self._unused = OrderedDict((s, None) for s in range(self.slots))
+        self.decoded = 0
+
+        self._thread = Thread(target=self._accept, name='pims_nd2-server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception:  # e.g. a client with a wrong key
+                if self._closed:
+                    return
+                continue
+            if self._closed:
+                conn.close()
+                return
+            thread = Thread(target=self._serve, args=(conn,),
+                            name='pims_nd2-server-client')
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        """Answers the requests of one client, until it disconnects."""
+        held = dict()  # slots in use by the client, with their counts
+        try:
+            while True:
+                try:
+                    command, args, releases = conn.recv()
+                except (EOFError, OSError):
+                    return
+                with self._cond:
+                    for s in releases:
+                        held[s] -= 1
+                        if held[s] == 0:
+                            del held[s]
+                        self._unref(s)
+                try:
+                    if command == 'describe':
+                        reply = (self._state, self._shm.name, self.slots,
+                                 self._shape, self._dtype.str)
+                    elif command == 'get':
+                        reply = self._get(args[0], held)
+                    else:
+                        raise ValueError('Unknown request {}'.format(command))
+                except Exception as e:
+                    reply = ('error', e)
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+        finally:
+            conn.close()
+            with self._cond:
+                for s, count in held.items():
+                    for _ in range(count):
+                        self._unref(s)
+
+    def _unref(self, s):
+        self._refs[s] -= 1
+        if self._refs[s] == 0:
+            self._unused[s] = None
+            if self._index_of[s] is None:  # empty slots are reused first
+                self._unused.move_to_end(s, last=False)
+
+    def _get(self, i, held):
+        s = self._acquire(i)
+        if s is None:  # all slots are in use
+            im, local_md = self.reader._read_seq_index(i)
+            return 'copy', np.array(im), local_md
+        held[s] = held.get(s, 0) + 1
+        return 'slot', s, self._metadata[s]
+
+    def _acquire(self, i):
+        """Returns the slot with picture `i`, after decoding it if needed,
+        and marks it as used. Returns None when all slots are in use."""
+        with self._cond:
+            while True:
+                s = self._slot_of.get(i)
+                if s is None:
+                    break
+                self._refs[s] += 1
+                self._unused.pop(s, None)
+                while not self._ready[s] and self._index_of[s] == i:
+                    self._cond.wait()  # decoding for another client
+                if self._index_of[s] == i:
+                    return s
+                self._unref(s)  # decoding failed: try again
+            if not self._unused:
+                return None
+            s, _ = self._unused.popitem(last=False)
+            if self._index_of[s] is not None:
+                del self._slot_of[self._index_of[s]]
+            self._slot_of[i] = s
+            self._index_of[s] = i
+            self._ready[s] = False
+            self._refs[s] = 1
+
+        try:
+            local_md = self.reader._read_seq_index_into(i, self._pictures[s])
+        except Exception:
+            with self._cond:
+                del self._slot_of[i]
+                self._index_of[s] = None
+                self._unref(s)
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self._metadata[s] = local_md
+            self._ready[s] = True
+            self.decoded += 1
+            self._cond.notify_all()
+        return s
+
+    def serve_forever(self):
+        """Blocks until the server is closed, e.g. from another thread."""
+        while self._thread.is_alive():
+            self._thread.join(1)
+
+    def close(self):
+        """Stops serving and releases the shared memory. Clients can no
+        longer read pictures."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            try:  # wake up the thread that waits for clients
+                Client(self.address, authkey=self.authkey).close()
+            except Exception:
+                pass
+            self._thread.join()
+        if self._listener is not None:
+            self._listener.close()
+        self._pictures = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:  # a picture is being decoded
+                pass
+            self._shm.unlink()
+            _served.discard(self._shm.name)
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, 'reader'):
+            self.close()
+
+
+class ND2_FrameClient(ND2_Reader):
+    """Reads an ND2 file through an ND2_FrameServer in another process.
+
+    The client has the interface of ND2_Reader, with the axes, metadata and
+    region of interest of the reader of the server. Pictures are not decoded
+    by the client, but read from the shared memory of the server: frames
+    with one picture are read-only views on it, without any copy. A slot of
+    shared memory is kept for the client until all views on it are deleted,
+    which the client tells the server with its next request or on close.
+
+    The region of interest and the scale are set by the server. Methods that
+    are not about pictures, such as `read_window` and `metadata_text`, use
+    the SDK of the client.
+
+    Parameters
+    ----------
+    address : str or tuple
+        The address of the server, see `ND2_FrameServer.address`.
+    authkey : bytes
+        The key of the server, see `ND2_FrameServer.authkey`.
+    """
+    def __init__(self, address, authkey):
+        self.address = address
+        self._authkey = authkey
+        self._shm = None
+        self._releases = []
+        self._conn_lock = Lock()
+        self._conn = None
+        self._conn = Client(address, authkey=authkey)
+        try:
+            state, name, slots, shape, dtype = self._request('describe')
+            self._shm = _attach(name)
+            self._slot_shape = tuple(shape)
+            self._slot_dtype = np.dtype(dtype)
+            self._slot_count = int(np.prod(self._slot_shape))
+            # pictures are not decoded nor cached by the client
+            state['options'].update(cache_size=0, prefetch=0,
+                                    index_cache=False, tile_cache_size=0,
+                                    memmap=False, handles=1)
+            self._restore(state, state['index'])
+        except Exception:
+            self.close()
+            raise
+
+    def _request(self, command, *args):
+        """Sends a request to the server, with the slots that are no longer
+        in use, and returns the reply."""
+        releases = []
+        while self._releases:
+            releases.append(self._releases.pop())
+        with self._conn_lock:
+            if self._conn is None:
+                raise IOError('Client is closed, unable to read data')
+            self._conn.send((command, args, releases))
+            reply = self._conn.recv()
+        if reply[0] == 'error':
+            raise reply[1]
+        return reply
+
+    def _set_rect(self, roi, scale):
+        if hasattr(self, '_rect'):
+            raise ValueError('The region of interest and the scale are set '
+                             'by the frame server.')
+        super(ND2_FrameClient, self)._set_rect(roi, scale)
+
+    @property
+    def _shared_pictures(self):
+        return True
+
+    def _read_seq_index(self, i):
+        """Returns a read-only view of picture `i` in the shared memory of
+        the server, and its stage position and time."""
+        pinned = self._get_pinned(i)
+        if pinned is not None:
+            return pinned
+        with self._timer('read_picture'):
+            reply = self._request('get', int(i))
+            if reply[0] == 'copy':
+                im = reply[1]
+                im.flags.writeable = False
+                return im, reply[2]
+            _, s, local_md = reply
+            # all views on the picture keep this array alive: the slot is
+            # released when it is deleted
+            im = np.frombuffer(self._shm.buf, self._slot_dtype,
+                               self._slot_count,
+                               s * self._slot_count * self._slot_dtype.itemsize)
+            im.flags.writeable = False
+            weakref.finalize(im, self._releases.append, s)
+            return im.reshape(self._slot_shape), local_md
+
+    def _decode(self, i, out, handle=None):
+        im, local_md = self._read_seq_index(i)
+        np.copyto(out, im)
+        return local_md
+
+    def __getstate__(self):
+        return {'address': self.address,
+                'authkey': self._authkey,
+                'iter_axes': list(self.iter_axes),
+                'bundle_axes': list(self.bundle_axes),
+                'default_coords': dict(self.default_coords)}
+
+    def __setstate__(self, state):
+        self.__init__(state['address'], state['authkey'])
+        self.default_coords.update(state['default_coords'])
+        self.bundle_axes = state['bundle_axes']
+        self.iter_axes = state['iter_axes']
+
+    def close(self):
+        if hasattr(self, '_pool'):
+            super(ND2_FrameClient, self).close()
+        with self._conn_lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:  # frames still use it
+                return
+            self._shm = None
@@ -0,0 +1,190 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock, local
+import numpy as np
+from . import ND2SDK as h
+from .ND2SDK import perf_counter
+
+# statistics that receive the SDK calls of all readers (see record_stats)
+_global_stats = []
+# per thread: statistics of the reader stages that are running
+_local = local()
+_lock = Lock()
+_users = [0]
+
+
+def _active_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _sdk_callback(name, seconds, nbytes):
+    targets = list(_global_stats)
+    stack = getattr(_local, 'stack', None)
+    if stack and stack[-1] not in targets:
+        targets.append(stack[-1])
+    for stats in targets:
+        stats.record(name, seconds, nbytes)
+
+
+def _enable():
+    """Wraps the SDK functions in timers, while there are users."""
+    with _lock:
+        _users[0] += 1
+        if _users[0] == 1:
+            h.instrument(_sdk_callback)
+
+
+def _disable():
+    with _lock:
+        _users[0] -= 1
+        if _users[0] == 0:
+            h.instrument(None)
+
+
+class _NullTimer(object):
+    """Timer that does nothing, used when statistics are disabled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+
+class ReadStats(object):
+    """Call counts, latencies and bytes per SDK function and reader stage.
+
+    SDK functions are recorded under their own name, e.g.
+    'Lim_FileGetImageRectData'. The reader stages are:
+
+    - 'get_frame': a whole frame, including the bundling of planes
+    - 'get_frame_2D', 'get_frame_cyx': one plane (with all channels)
+    - 'read_picture': one SDK picture, from the cache, the prefetcher or
+      the file
+    - 'decode': reading one SDK picture from the file
+    - 'copy': the copy of a picture into a frame
+    - 'frame': building the Frame object
+
+    Parameters
+    ----------
+    hook : callable, optional
+        Called as `hook(name, seconds, nbytes)` after each recorded call, for
+        instance to export to a metrics system.
+    max_samples : int, optional
+        Number of latest latencies per name that are kept for percentiles.
+        Defaults to 10000.
+    """
+    def __init__(self, hook=None, max_samples=10000):
+        self.hook = hook
+        self.max_samples = max_samples
+        self._lock = Lock()
+        self._entries = dict()
+
+    def record(self, name, seconds, nbytes=0):
+        """Records one call of `name`, which took `seconds` and read
+        `nbytes`."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = [0, 0., 0, deque(maxlen=self.max_samples)]
+                self._entries[name] = entry
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += nbytes
+            entry[3].append(seconds)
+        if self.hook is not None:
+            self.hook(name, seconds, nbytes)
+
+    @contextmanager
+    def timer(self, name, nbytes=0):
+        """Records the time spent in the block as a call of `name`. SDK calls
+        in the block, on the same thread, are recorded too."""
+        stack = _active_stack()
+        stack.append(self)
+        start = perf_counter()
+        try:
+            yield self
+        finally:
+            self.record(name, perf_counter() - start, nbytes)
+            stack.pop()
+
+    def summary(self):
+        """Returns a dict with per name: the number of calls, the total,
+        mean, median, 90th and 99th percentile and maximum latency in
+        seconds, the number of bytes and the throughput in MB/s."""
+        with self._lock:
+            entries = dict((k, (v[0], v[1], v[2], np.array(v[3])))
+                           for k, v in self._entries.items())
+        summary = dict()
+        for name, (count, total, nbytes, samples) in entries.items():
+            p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+            summary[name] = {'count': count,
+                             'total_s': total,
+                             'mean_s': total / count,
+                             'p50_s': p50,
+                             'p90_s': p90,
+                             'p99_s': p99,
+                             'max_s': samples.max(),
+                             'nbytes': nbytes,
+                             'mb_per_s': nbytes / 1e6 / total if total
+                                         else 0.}
+        return summary
+
+    def reset(self):
+        """Forgets all recorded calls."""
+        with self._lock:
+            self._entries.clear()
+
+    def __repr__(self):
+        lines = ['{:<26} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+                 'name', 'count', 'total ms', 'p50 ms', 'p99 ms', 'MB/s')]
+        summary = self.summary()
+        for name in sorted(summary, key=lambda k: -summary[k]['total_s']):
+            s = summary[name]
+            lines.append('{:<26} {:>8} {:>10.3f} {:>10.4f} {:>10.4f} '
+                         '{:>10.1f}'.format(name, s['count'],
+                                            1e3 * s['total_s'],
+                                            1e3 * s['p50_s'],
+                                            1e3 * s['p99_s'],
+                                            s['mb_per_s']))
+        return '\n'.join(lines)
+
+
+@contextmanager
+def record_stats(reader=None, hook=None):
+    """Context manager that records statistics within the block, and yields
+    the ReadStats.
+
+    With a reader, the stages and SDK calls of that reader are recorded (see
+    `ND2_Reader.enable_stats`). Without, the SDK calls of all readers.
+
+    Examples
+    ----------
+    >>> with record_stats(reader) as stats:
+    ...     frames = list(reader)
+    >>> stats.summary()['decode']['p99_s']
+    """
+    if reader is not None:
+        enabled = reader.stats is not None
+        stats = reader.enable_stats(hook)
+        try:
+            yield stats
+        finally:
+            if not enabled:
+                reader.disable_stats()
+        return
+    stats = ReadStats(hook)
+    _enable()
+    _global_stats.append(stats)
+    try:
+        yield stats
+    finally:
+        _global_stats.remove(stats)
+        _disable()
@@ -1,13 +1,23 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import six
+import gc
 import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
+import weakref
 import nose
 import numpy as np
 from numpy.testing import (assert_equal, assert_almost_equal, assert_allclose)
 
-from pims_nd2 import ND2_Reader
+from pims_nd2 import ND2_Reader, preview_pyramid, convert, record_stats
+from pims_nd2 import ND2SDK as h
+from pims_nd2 import ND2_Dataset
 
 path, _ = os.path.split(os.path.abspath(__file__))
 
@@ -21,6 +31,10 @@ def assert_image_equal(actual, expected):
         assert_allclose(actual, expected, atol=1/256.)
 
 
+def _frame_sums(reader):
+    return [int(frame.sum()) for frame in reader]
+
+
 class _image_single(object):
     def check_skip(self):
         pass
@@ -141,6 +155,20 @@ class TestND2(_image_series, _image_stack, _image_multichannel,
         assert_almost_equal(self.v.calibration, 0.167808983)
         assert_allclose(self.v.colors[0], [0.47, 0.91, 0.06], atol=0.01)
 
+    def test_metadata_text(self):
+        text = self.v.metadata_text
+        assert text.startswith('Dimensions: T(3) x Z(10)')
+        # the last field of LIMTEXTINFO, which the SDK writes as well
+        assert_equal(self.v._lim_textinfo.wszAppVersion,
+                     '4.20.01 (Build 982)')
+
+    def test_metadata_after_close(self):
+        with ND2_Reader(self.filename) as v:
+            pass
+        assert_almost_equal(v.calibration, 0.167808983)
+        assert_allclose(v.colors[0], [0.47, 0.91, 0.06], atol=0.01)
+        assert_equal(v._z_home, 4)
+
     def test_time(self):
         time = self.v.metadata['time_start_utc']
         assert_equal((time.year, time.month, time.day, time.hour, time.minute,
@@ -155,6 +183,608 @@ class TestND2(_image_series, _image_stack, _image_multichannel,
         assert_almost_equal(frame.metadata['t_ms'], 445.08349828)
         assert_equal(frame.metadata['t'], 0)
 
+    def test_bundle_channels(self):
+        self.v.bundle_axes = 'czyx'
+        stack = self.v[1]
+        assert_equal(stack.shape, (2, 10, 31, 38))
+        self.v.bundle_axes = 'zyx'
+        for c in range(2):
+            self.v.default_coords['c'] = c
+            assert_image_equal(stack[c], self.v[1])
+
+    def test_read_into(self):
+        self.v.bundle_axes = 'cyx'
+        expected = self.v[1]
+        out = np.empty((31, 38, 2), dtype=self.v.pixel_type)
+        self.v.read_into(out, t=1)
+        assert_image_equal(np.rollaxis(out, 2), expected)
+        out = np.empty((2, 31, 38), dtype=self.v.pixel_type)
+        assert_image_equal(self.v.read_into(out, t=1), expected)
+        out = np.empty((31, 38), dtype=self.v.pixel_type)
+        assert_image_equal(self.v.read_into(out, t=1, c=1), expected[1])
+        self.assertRaises(ValueError, self.v.read_into,
+                          np.empty((31, 38), dtype=np.float64), t=1)
+
+    def test_read_frames_into(self):
+        self.v.bundle_axes = 'cyx'
+        self.v.default_coords['z'] = 4
+        seq_indices = [self.v.get_seq_index(t=t, z=4) for t in (2, 0)]
+        out = np.empty((2, 31, 38, 2), dtype=self.v.pixel_type)
+        self.v.read_frames_into(out, seq_indices)
+        assert_image_equal(np.rollaxis(out[0], 2), self.v[2])
+        assert_image_equal(np.rollaxis(out[1], 2), self.v[0])
+
+    def test_cache(self):
+        with ND2_Reader(self.filename, cache_size=10 * 31 * 38 * 2 * 2,
+                        memmap=False) as v:
+            v.bundle_axes = 'yx'
+            first = v[0]
+            assert_equal((v.cache.hits, v.cache.misses), (0, 1))
+            assert_image_equal(v[0], first)
+            assert_equal((v.cache.hits, v.cache.misses), (1, 1))
+            v.bundle_axes = 'zyx'
+            v[1], v[2]
+            assert_equal(len(v.cache), 10)
+            assert_equal(v.cache.nbytes, 10 * 31 * 38 * 2 * 2)
+            v.clear_cache()
+            assert_equal(len(v.cache), 0)
+
+    def test_roi(self):
+        self.v.bundle_axes = 'czyx'
+        full = self.v[1]
+        self.v.roi = (5, 20, 3, 30)
+        assert_equal(self.v.frame_shape, (2, 10, 15, 27))
+        assert_image_equal(self.v[1], full[:, :, 5:20, 3:30])
+        self.v.bundle_axes = 'yx'
+        assert_image_equal(self.v[1], full[0, 0, 5:20, 3:30])
+        self.v.roi = None
+        assert_equal(self.v.frame_shape, (31, 38))
+        self.assertRaises(ValueError, setattr, self.v, 'roi', (0, 40, 0, 5))
+
+    def test_scale(self):
+        self.v.bundle_axes = 'cyx'
+        full = self.v[1]
+        self.v.scale = 0.5
+        assert_equal(self.v.frame_shape, (2, 16, 19))
+        assert_equal(self.v[1].metadata['mpp'], 2 * self.v.calibration)
+        self.assertTrue(self.v[1].max() <= full.max())
+        self.v.roi = (10, 20, 4, 12)
+        assert_equal(self.v.frame_shape, (2, 5, 4))
+        self.v.scale = 1
+        assert_equal(self.v.frame_shape, (2, 10, 8))
+
+    def test_preview_pyramid(self):
+        pyramid = preview_pyramid(self.filename, levels=3, scale=0.5)
+        assert_equal([p.shape for p in pyramid],
+                     [(30, 16, 19, 2), (30, 8, 9, 2), (30, 4, 4, 2)])
+
+    def test_get_frames_threaded(self):
+        seq_indices = list(range(30)) * 4
+        expected = self.v.get_frames(seq_indices, workers=1)
+        with ND2_Reader(self.filename, handles=4, memmap=False) as v:
+            actual = v.get_frames(seq_indices)
+        assert_image_equal(actual, expected)
+        self.v.bundle_axes = 'cyx'
+        assert_image_equal(np.rollaxis(expected[10], 2), self.v[1])
+
+    def test_prefetch(self):
+        self.v.bundle_axes = 'czyx'
+        expected = list(self.v)
+        with ND2_Reader(self.filename, prefetch=2, memmap=False) as v:
+            v.bundle_axes = 'czyx'
+            for frame, exp in zip(v, expected):
+                assert_image_equal(frame, exp)
+            assert_image_equal(v[2], expected[2])
+            assert_image_equal(v[0], expected[0])
+
+    def test_prefetch_iteration(self):
+        self.v.bundle_axes = 'czyx'
+        expected = list(self.v)
+        with ND2_Reader(self.filename, prefetch=1, memmap=False) as v:
+            v.bundle_axes = 'czyx'
+            hits = []
+            scheduled = []
+            take = v._prefetcher.take
+            schedule = v._prefetcher.schedule
+
+            def counting_take(i):
+                result = take(i)
+                hits.append(result is not None)
+                return result
+
+            def counting_schedule(wanted, keep=()):
+                scheduled.append(len(wanted))
+                schedule(wanted, keep)
+
+            v._prefetcher.take = counting_take
+            v._prefetcher.schedule = counting_schedule
+            for key in (slice(None), [2, 0, 0, 1]):
+                del hits[:]
+                for frame, i in zip(v[key], np.arange(3)[key]):
+                    assert_image_equal(frame, expected[i])
+                    time.sleep(0.1)  # time for the prefetch thread
+                # the pictures of all frames but the first are prefetched,
+                # and repeated frames are not read again
+                assert_equal(len(hits), 30)
+                assert_equal(sum(hits), 20)
+            # one frame of 10 pictures ahead
+            assert_equal(max(scheduled), 10)
+
+    def test_iteration_pins(self):
+        self.v.bundle_axes = 'zyx'
+        expected = list(self.v)
+        with ND2_Reader(self.filename, memmap=False) as v:
+            v.bundle_axes = 'zyx'
+            first = iter(v[[0, 1, 1, 2]])
+            assert_image_equal(next(first), expected[0])
+            # another iterator does not drop the pictures of the first
+            assert_equal(len(list(v[[1, 0]])), 2)
+            assert_equal(len(v._pinned), 1)
+            assert_image_equal(next(first), expected[1])
+            # pinned pictures of the previous shape are not served
+            v.roi = (0, 10, 0, 20)
+            assert_equal(next(first).shape, (10, 10, 20))
+            first.close()
+            assert_equal(len(v._pinned), 0)
+
+    def test_prefetch_collected(self):
+        v = ND2_Reader(self.filename, prefetch=2, memmap=False)
+        v[0]
+        thread = v._prefetcher._thread
+        ref = weakref.ref(v)
+        del v
+        for _ in range(100):  # the thread may be decoding for the reader
+            gc.collect()
+            if ref() is None:
+                break
+            time.sleep(0.01)
+        assert ref() is None
+        thread.join(5)
+        assert not thread.is_alive()
+
+    def test_seq_index_table(self):
+        assert_equal(self.v.seq_index_table.shape, (3, 1, 10, 1))
+        assert_equal(self.v.coords_table.shape, (30, 4))
+        assert_equal(self.v.get_seq_index(t=1, z=3), 13)
+        assert_equal(self.v.coords_table[13], [1, 0, 3, 0])
+        assert_equal(self.v.get_seq_index(t=[0, 2], z=[[1], [2]]),
+                     [[1, 21], [2, 22]])
+        seq = self.v.get_seq_index(t=self.v.coords_table[:, 0],
+                                   z=self.v.coords_table[:, 2])
+        assert_equal(seq, np.arange(30))
+
+    def test_frame_table(self):
+        table = self.v.frame_table
+        assert_equal(len(table), 30)
+        assert_equal(table['seq_index'], np.arange(30))
+        assert_equal(table['t'][13], 1)
+        assert_equal(table['z'][13], 3)
+        self.v.bundle_axes = 'yx'
+        frame = self.v[1]
+        for k in ('t_ms', 'x_um', 'y_um', 'z_um'):
+            assert_equal(table[k][10], frame.metadata[k])
+        assert_allclose(self.v.frame_rate, 0.094, rtol=0.01)
+
+    def test_index_cache(self):
+        self.v.bundle_axes = 'cyx'
+        expected = self.v[1]
+        index_dir = tempfile.mkdtemp()
+        try:
+            decode = h.Lim_FileGetImageRectData
+            try:
+                h.Lim_FileGetImageRectData = None  # no pictures read to open
+                v = ND2_Reader(self.filename, index_cache=index_dir)
+            finally:
+                h.Lim_FileGetImageRectData = decode
+            assert_equal(len(os.listdir(index_dir)), 1)
+            with v:  # parts that are read are added to the index
+                v.metadata
+                v.frame_table
+            with ND2_Reader(self.filename, index_cache=index_dir) as v:
+                assert_equal(len(v._pool), 0)  # SDK not touched yet
+                assert_equal(v.sizes, self.v.sizes)
+                assert_equal(v.metadata['plane_0']['name'], '5-FAM/pH 9.0')
+                assert_allclose(v.frame_rate, self.v.frame_rate)
+                assert_equal(v.frame_table, self.v.frame_table)
+                assert_equal(len(v._pool), 0)
+                v.bundle_axes = 'cyx'
+                assert_image_equal(v[1], expected)
+        finally:
+            shutil.rmtree(index_dir)
+
+    def test_to_dask(self):
+        try:
+            import dask.array
+        except ImportError:
+            raise unittest.SkipTest('dask is not installed')
+        self.v.close()
+        self.v = ND2_Reader(self.filename, memmap=False)
+        arr = self.v.to_dask()
+        assert_equal(arr.shape, (3, 10, 2, 31, 38))
+        assert_equal(arr.chunksize, (1, 1, 2, 31, 38))
+        self.v.bundle_axes = 'zcyx'
+        assert_image_equal(arr[1].compute(), self.v[1])
+        arr = self.v.to_dask(chunks={'z': 4})
+        assert_image_equal(arr[1, 3:8, 1, 2:9, 5].compute(),
+                           self.v[1][3:8, 1, 2:9, 5])
+
+        from pims_nd2 import dask_array
+        with ND2_Reader(self.filename) as v:
+            for scale in (1, 0.5, 0.25):
+                v.scale = scale
+                v.to_dask()[0].compute(scheduler='threads')
+            sources = set(k[1] for k in dask_array._readers)
+            assert len(sources) == 3
+            dask_array.MAX_READERS = 2
+            try:
+                v.to_dask()[1].compute(scheduler='threads')
+            finally:
+                dask_array.MAX_READERS = 4
+            assert_equal(len(dask_array._readers), 2)
+            readers = list(dask_array._readers.values())
+        assert_equal(len(dask_array._readers), 0)
+        assert all(r._pool.closed for r in readers)
+
+    def test_convert(self):
+        self.v.bundle_axes = 'zcyx'
+        expected = self.v[2]
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for ext, module in (('.zarr', 'zarr'), ('.h5', 'h5py')):
+                try:
+                    store = __import__(module)
+                except ImportError:
+                    continue
+                output = os.path.join(tmpdir, 'cluster' + ext)
+                convert(self.filename, output, workers=3, memmap=False)
+                if ext == '.zarr':
+                    f = store.open_group(output, mode='r')
+                else:
+                    f = store.File(output, 'r')
+                assert_equal(f['image'].shape, (3, 10, 2, 31, 38))
+                assert_image_equal(f['image'][2], expected)
+                assert_equal(f['frame_table/t_ms'][:],
+                             self.v.frame_table['t_ms'])
+                if ext == '.h5':
+                    f.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_read_block(self):
+        self.v.close()
+        self.v = ND2_Reader(self.filename, memmap=False)
+        self.v.bundle_axes = 'czyx'
+        volume = self.v.get_volume(t=1)
+        assert_equal(volume.shape, (2, 10, 31, 38))
+        assert_image_equal(volume, self.v[1])
+        assert_equal(volume.metadata['axes'], ['c', 'z', 'y', 'x'])
+        assert_equal(volume.metadata['t_ms'].shape, (10,))
+        assert_equal(volume.metadata['t_ms'],
+                     self.v.frame_table['t_ms'][10:20])
+
+        block = self.v.read_block(t=[2, 0, 2], z=slice(2, 5), c=1,
+                                  workers=2)
+        assert_equal(block.shape, (3, 3, 31, 38))
+        assert_equal(block.metadata['axes'], ['t', 'z', 'y', 'x'])
+        assert_image_equal(block[0], self.v[2][1, 2:5])
+        assert_image_equal(block[1], self.v[0][1, 2:5])
+        assert_image_equal(block[2], block[0])
+        assert_equal(block.metadata['z_um'].shape, (3, 3))
+        self.assertRaises(IndexError, self.v.read_block, z=[10])
+
+    def test_disk_order(self):
+        self.v.close()
+        self.v = ND2_Reader(self.filename, memmap=False)
+        expected = [self.v[i] for i in [1, 0, 0, 1, 1]]
+        decoded = []
+        decode_new = self.v._decode_new
+
+        def _decode_new(i, handle=None):
+            decoded.append(i)
+            return decode_new(i, handle)
+        self.v._decode_new = _decode_new
+
+        frames = list(self.v[[1, 0, 0, 1, 1]])
+        assert_equal(decoded, list(range(20)))
+        assert_equal(len(frames), 5)
+        for frame, expected_frame in zip(frames, expected):
+            assert_image_equal(frame, expected_frame)
+        frames[1][:] = 0
+        assert_image_equal(frames[2], expected[2])
+
+        del decoded[:]
+        frames = list(self.v[::-1][1:])
+        assert_equal(sorted(decoded), decoded)
+        assert_image_equal(frames[0], self.v[1])
+
+    def test_stats(self):
+        self.v.close()
+        self.v = ND2_Reader(self.filename, memmap=False)
+        assert self.v.stats is None
+        decode = h.Lim_FileGetImageRectData
+        records = []
+        with record_stats(self.v, hook=lambda *args: records.append(args)) \
+                as stats:
+            assert h.Lim_FileGetImageRectData is not decode
+            self.v.bundle_axes = 'czyx'
+            self.v[0]
+        assert h.Lim_FileGetImageRectData is decode
+        assert self.v.stats is None
+
+        summary = stats.summary()
+        assert_equal(summary['get_frame']['count'], 1)
+        assert_equal(summary['get_frame_cyx']['count'], 10)
+        assert_equal(summary['decode']['nbytes'], 10 * 2 * 31 * 38 * 2)
+        assert_equal(summary['Lim_FileGetImageRectData']['count'], 10)
+        assert summary['decode']['p99_s'] >= summary['decode']['p50_s']
+        assert_equal(len(records), sum(s['count'] for s in summary.values()))
+        stats.reset()
+        assert_equal(stats.summary(), dict())
+
+    def test_lazy_loading(self):
+        code = ('import pims_nd2; from pims_nd2 import ND2SDK as h; '
+                'assert not h._library')
+        assert_equal(subprocess.call([sys.executable, '-c', code]), 0)
+
+        with ND2_Reader(self.filename) as v:
+            assert_equal(v.sizes['z'], 10)
+            assert v._metadata_desc is None
+            assert_almost_equal(v.calibration, 0.167808983)
+            assert_equal(len(v.colors), 2)
+            assert v._metadata_desc is not None
+
+    def test_dataset(self):
+        with ND2_Dataset([self.filename] * 4, max_open=2,
+                         memmap=False) as d:
+            assert_equal(d.sizes['f'], 4)
+            assert_equal(d.iter_axes, ['f', 't'])
+            assert_equal(len(d), 12)
+            frame = d[5]
+            assert_image_equal(frame, self.v[2])
+            assert_equal((frame.metadata['f'], frame.metadata['t']), (1, 2))
+            d.bundle_axes = 'czyx'
+            for i in (0, 3, 6, 9):
+                d[i]
+            assert_equal(d.open_files, [2, 3])
+            assert_equal(d.metadata['filenames'], [self.filename] * 4)
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'requires Python 3.7')
+    def test_asyncio(self):
+        import asyncio
+        from pims_nd2._async_reads import read
+        expected = [self.v[i] for i in range(3)]
+        frames, iterated, plane, first = asyncio.run(read(self.filename))
+        for i, frame in zip((2, 0, 1), frames):
+            assert_image_equal(frame, expected[i])
+        for i, frame in enumerate(iterated):
+            assert_image_equal(frame, expected[i])
+        assert_image_equal(plane, expected[1][3])
+        assert_image_equal(first, expected[1])
+
+    def test_read_window(self):
+        self.v.bundle_axes = 'cyx'
+        full = self.v[1]
+        window = self.v.read_window(5, 20, 3, 30, t=1)
+        assert_image_equal(window, full[0, 5:20, 3:30])
+        assert_equal(self.v.tile_shape, (31, 38))
+        self.assertRaises(ValueError, self.v.read_window, 0, 40, 0, 5)
+
+        with ND2_Reader(self.filename, tile_shape=(8, 10),
+                        tile_cache_size=10 ** 6) as v:
+            window = v.read_window(5, 20, 3, 30, t=1, c=None)
+            assert_image_equal(window, full[:, 5:20, 3:30])
+            assert_equal(len(v.tile_cache), 3 * 3)
+            misses = v.tile_cache.misses
+            window = v.read_window(9, 31, 0, 38, t=1, c=1)
+            assert_image_equal(window, full[1, 9:31])
+            assert_equal(v.tile_cache.misses - misses, 3 * 4 - 2 * 3)
+
+    def test_memmap(self):
+        assert self.v._raw is None  # made on the first read
+        assert self.v.memmap
+        self.v.bundle_axes = 'czyx'
+        with ND2_Reader(self.filename, memmap=False) as v:
+            assert not v.memmap
+            v.bundle_axes = 'czyx'
+            for i in range(3):
+                assert_image_equal(self.v[i], v[i])
+            assert self.v._frame_table is None
+            v.bundle_axes = 'yx'
+            self.v.bundle_axes = 'yx'
+            frame = self.v[1]
+            for k in ('t_ms', 'x_um', 'y_um', 'z_um'):
+                assert_equal(frame.metadata[k], v[1].metadata[k])
+            decode = h.Lim_FileGetImageRectData
+            try:
+                # no SDK reads: the positions of a picture are read once
+                h.Lim_FileGetImageRectData = None
+                frame = self.v[1]
+            finally:
+                h.Lim_FileGetImageRectData = decode
+            assert_image_equal(frame, v[1])
+            assert self.v._frame_table is None
+            frame -= 1  # a copy
+            assert_image_equal(self.v[1], v[1])
+            assert_image_equal(self.v.read_block(t=1, z=slice(None)),
+                               v.read_block(t=1, z=slice(None)))
+            assert_image_equal(self.v.read_window(3, 20, 5, 30, c=1),
+                               v.read_window(3, 20, 5, 30, c=1))
+            v.roi = self.v.roi = (5, 20, 3, 30)
+            assert_image_equal(self.v[1], v[1])
+        self.v.scale = 0.5  # read through the SDK
+        assert not self.v.memmap
+        assert self.v[1].flags.writeable
+        with ND2_Reader(self.filename, memmap='view') as v:
+            assert v.memmap
+            v.bundle_axes = 'yx'
+            frame = v[1]
+            assert not frame.flags.writeable  # a view on the file
+            with ND2_Reader(self.filename, memmap=False) as expected:
+                expected.bundle_axes = 'yx'
+                assert_image_equal(frame, expected[1])
+
+    def test_pickle(self):
+        self.v.bundle_axes = 'cyx'
+        self.v.iter_axes = 'z'
+        self.v.default_coords['t'] = 1
+        self.v.roi = (5, 20, 3, 30)
+        expected = self.v[2]
+        for memmap in (True, False):
+            with ND2_Reader(self.filename, memmap=memmap) as v:
+                v.bundle_axes = 'cyx'
+                v.iter_axes = 'z'
+                v.default_coords['t'] = 1
+                v.roi = (5, 20, 3, 30)
+                v.seq_index_table
+                data = pickle.dumps(v)
+            v = pickle.loads(data)
+            try:
+                assert_equal(len(v._pool), 0)  # reopened lazily
+                assert_equal(v.memmap, memmap)
+                assert_equal(v.sizes, self.v.sizes)
+                assert_equal(v.iter_axes, ['z'])
+                assert_equal(len(v), 10)
+                assert_image_equal(v[2], expected)
+                assert_equal(v[2].metadata['t'], 1)
+            finally:
+                v.close()
+
+        self.v.bundle_axes = 'zyx'
+        self.v.iter_axes = 't'
+        self.v.roi = None
+        expected = _frame_sums(self.v)
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+        except ImportError:  # Python 2 without the futures backport
+            return
+        with ProcessPoolExecutor(2) as executor:
+            results = list(executor.map(_frame_sums, [self.v] * 2))
+        assert_equal(results, [expected] * 2)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_fork(self):
+        with ND2_Reader(self.filename, memmap=False, prefetch=1) as v:
+            expected = [v[i] for i in range(3)]
+            pid = os.fork()
+            if pid == 0:  # child: read with its own handles and thread
+                status = 1
+                try:
+                    if (all((v[i] == expected[i]).all() for i in (2, 0)) and
+                            len(v._pool) == 1):
+                        status = 0
+                    v.close()
+                finally:
+                    os._exit(status)
+            _, status = os.waitpid(pid, 0)
+            assert_equal(status, 0)
+            assert_equal(len(v._pool), 1)
+            assert_image_equal(v[1], expected[1])
+
+    @unittest.skipIf(sys.version_info < (3, 8), 'requires Python 3.8')
+    def test_frame_server(self):
+        from pims_nd2 import ND2_FrameServer, ND2_FrameClient
+        self.v.bundle_axes = 'czyx'
+        expected = list(self.v)
+        with ND2_FrameServer(self.filename, slots=32, memmap=False,
+                             handles=2) as server:
+            clients = [ND2_FrameClient(server.address, server.authkey)
+                       for _ in range(2)]
+            try:
+                for c in clients:
+                    assert_equal(c.sizes, self.v.sizes)
+                    c.bundle_axes = 'czyx'
+                for frames in zip(expected, *clients):
+                    for frame in frames[1:]:
+                        assert_image_equal(frame, frames[0])
+                assert_equal(server.decoded, 30)  # once for both clients
+
+                c = clients[0]
+                c.bundle_axes = 'yx'
+                frame = c[1]
+                assert not frame.flags.writeable  # a view, not a copy
+                assert_image_equal(frame, expected[1][0, 0])
+                assert_equal(frame.metadata['t_ms'],
+                             self.v.frame_table['t_ms'][10])
+                self.assertRaises(ValueError, setattr, c, 'roi', (0, 5, 0, 5))
+
+                from multiprocessing import AuthenticationError
+                self.assertRaises(AuthenticationError, ND2_FrameClient,
+                                  server.address, b'wrong key')
+
+                code = ('from pims_nd2 import ND2_FrameClient; '
+                        'c = ND2_FrameClient({!r}, bytes.fromhex({!r})); '
+                        'c.bundle_axes = "yx"; '
+                        'print(int(c[2].sum())); c.close()'
+                        .format(server.address, server.authkey.hex()))
+                out = subprocess.check_output([sys.executable, '-c', code],
+                                              cwd=os.path.dirname(path))
+                assert_equal(int(out), expected[2][0, 0].sum())
+                assert_equal(server.decoded, 30)
+            finally:
+                for c in clients:
+                    c.close()
+
+    def test_project(self):
+        self.v.close()
+        self.v = ND2_Reader(self.filename, memmap=False)
+        volumes = np.array([self.v.get_volume(t=t) for t in range(3)])
+        for op in ('max', 'min', 'sum', 'mean', 'std'):
+            expected = getattr(np, op)(volumes.astype(np.float64), axis=2)
+            for workers in (1, 3):
+                mip = self.v.project('z', op, workers=workers)
+                assert_equal(mip.sizes, {'t': 3, 'c': 2, 'y': 31, 'x': 38})
+                assert_equal(mip.iter_axes, ['t'])
+                mip.bundle_axes = 'cyx'
+                for t in range(3):
+                    assert_allclose(mip[t], expected[t])
+                assert_equal(mip[1].metadata['projection'], op)
+        assert_equal(self.v.project('z', 'max').pixel_type, np.uint16)
+
+        tmean = self.v.project('t', 'mean')
+        assert_equal(tmean.bundle_axes, ['z', 'y', 'x'])
+        assert_equal(len(tmean), 1)
+        assert_allclose(tmean[0], volumes[:, 0].mean(axis=0))
+        tmean.default_coords['c'] = 1
+        assert_allclose(tmean[0], volumes[:, 1].mean(axis=0))
+        self.assertRaises(ValueError, self.v.project, 'm')
+        self.assertRaises(ValueError, self.v.project, 'z', 'median')
+
+    def test_read_boxes(self):
+        boxes = np.array([[1, 0, 3, 5, 6, 8, 10],
+                          [0, 0, 2, 0, 0, 4, 4],
+                          [1, 0, 3, 25, 30, 8, 10],  # partly outside
+                          [1, 0, 3, 20, 1, 3, 2]])
+        self.v.close()
+        self.v = ND2_Reader(self.filename, memmap=False)
+        decoded = []
+        read_seq_index_into = self.v._read_seq_index_into
+
+        def _read_seq_index_into(i, out):
+            decoded.append(i)
+            return read_seq_index_into(i, out)
+        self.v._read_seq_index_into = _read_seq_index_into
+
+        crops = self.v.read_boxes(boxes, fill_value=7)
+        assert_equal(sorted(decoded), [2, 13])  # once per picture
+        assert_equal(crops.shape, (4, 2, 8, 10))
+        assert_equal(crops.metadata['axes'], ['box', 'c', 'y', 'x'])
+        assert_equal(crops.metadata['seq_index'], [13, 2, 13, 13])
+        for crop, (t, m, z, y0, x0, h, w) in zip(crops, boxes):
+            volume = self.v.get_volume(t=t)[:, z]
+            part = volume[:, y0:y0 + h, x0:x0 + w]
+            ph, pw = part.shape[1:]
+            assert_image_equal(crop[:, :ph, :pw], part)
+            assert np.all(crop[:, ph:] == 7) and np.all(crop[:, :, pw:] == 7)
+        assert_equal(crops.metadata['t_ms'][0],
+                     self.v.frame_table['t_ms'][13])
+
+        table = {'t': boxes[:, 0], 'z': boxes[:, 2], 'y0': boxes[:, 3],
+                 'x0': boxes[:, 4], 'h': boxes[:, 5], 'w': boxes[:, 6]}
+        one = self.v.read_boxes(table, c=1, workers=2, fill_value=7)
+        assert_equal(one.shape, (4, 8, 10))
+        assert_image_equal(one, crops[:, 1])
+        self.assertRaises(ValueError, self.v.read_boxes, boxes[:, :6])
+
     def tearDown(self):
         self.v.close()
 
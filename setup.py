@@ -18,10 +18,11 @@ setup_parameters = dict(
     version="1.1",
     description="An image reader for nd2 (NIS Elements) multidimensional images",
     author="Casper van der Wel",
-    install_requires=['pims>=0.3'],
+    install_requires=['pims>=0.3', 'futures; python_version < "3"'],
     author_email="caspervdw@gmail.com",
     url="https://github.com/soft-matter/pims_nd2",
     packages=['pims_nd2'],
+    entry_points={'console_scripts': ['nd2convert = pims_nd2.convert:main']},
     include_package_data=True,
     classifiers=["Development Status :: 5 - Production/Stable",
                  "Intended Audience :: Science/Research",